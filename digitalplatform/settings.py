@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
 from decouple import config
 from celery.schedules import crontab
+from kombu import Exchange, Queue
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -59,6 +61,11 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Views answer platform throttling (RateLimitExceeded) with a 429.
+REST_FRAMEWORK = {
+    "EXCEPTION_HANDLER": "socialmedia.utils.exception_handler",
+}
+
 ROOT_URLCONF = "digitalplatform.urls"
 
 TEMPLATES = [
@@ -152,12 +159,116 @@ TWITTER_BASED_API_URL = "https://api.twitter.com/"
 X_UPLOAD_URL = "https://upload.x.com/"
 X_REDIRECT_URL = "https://fe71-188-55-169-8.ngrok-free.app/x_success"
 
+# "celery" sends each due post to a publish_post task on its platform queue
+# (linkedin, x, tiktok); "threads" publishes in-process on the publisher pool,
+# whose timer thread holds each post until its scheduled time.
+POSTING_DISPATCH_MODE = "celery"
+# "eta" publishes each post at its scheduled time: posts due within the
+# horizon are queued as ETA tasks. "window" keeps the legacy behaviour of
+# publishing everything scheduled 3 to 4 hours ahead.
+POSTING_SCHEDULE_MODE = "eta"
+POSTING_ETA_HORIZON = timedelta(minutes=5)
+POSTING_LATE_GRACE = timedelta(hours=1)
+# A dispatched post that has not started this long after it was due, or whose
+# retry is this overdue, lost its publish task and is dispatched again.
+POSTING_STRANDED_AFTER = timedelta(minutes=15)
+# Downloaded post media shared by all publishers. Entries are checked against
+# the source again (with the ETag when there is one) once older than
+# MEDIA_CACHE_MAX_AGE; a lease older than MEDIA_CACHE_LEASE is treated as
+# released so a crashed worker cannot pin a file forever.
+MEDIA_CACHE_DIR = BASE_DIR / "media_cache"
+MEDIA_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+MEDIA_CACHE_MAX_AGE = timedelta(hours=1)
+MEDIA_CACHE_LEASE = timedelta(hours=6)
+# Media of posts due within the horizon is downloaded ahead of time and held
+# in the media store until the post is published. The horizon covers the
+# 3 to 4 hour lead of the "window" schedule mode.
+MEDIA_PREFETCH_HORIZON = timedelta(hours=4)
+MEDIA_PREFETCH_CONCURRENCY = 4
+# Shared HTTP clients: (connect, read) timeout in seconds, connections kept
+# per host and retries for idempotent GET/HEAD requests.
+HTTP_TIMEOUT = (10, 60)
+HTTP_POOL_SIZE = 20
+HTTP_RETRIES = 3
+# Media is downloaded and streamed into uploads MEDIA_CHUNK_SIZE bytes at a
+# time; X video uploads are sent as APPEND segments of X_MEDIA_SEGMENT_SIZE.
+MEDIA_CHUNK_SIZE = 1024 * 1024
+X_MEDIA_SEGMENT_SIZE = 4 * 1024 * 1024
+# How long a follow-up task keeps checking whether X has processed an uploaded
+# video before the post is marked as failed.
+X_MEDIA_PROCESSING_TIMEOUT = 60 * 60
+# Chunks of one upload sent at once, per platform, and the bytes an upload may
+# have outstanding. TikTok FILE_UPLOAD expects chunks in order, so it stays at 1.
+UPLOAD_PARALLELISM = {
+    "tiktok": 1,
+    "x": 4,
+}
+UPLOAD_MAX_BYTES_IN_FLIGHT = 32 * 1024 * 1024
+# Token buckets shared by all workers: `rate` tokens per second up to `burst`,
+# for the platform app as a whole and for each account. Calls wait at most
+# RATE_LIMIT_MAX_WAIT seconds for a token before failing with RateLimitExceeded.
+RATE_LIMIT_REDIS_URL = "redis://localhost:6379/1"
+RATE_LIMITS = {
+    "linkedin": {"app": {"rate": 5, "burst": 20}, "account": {"rate": 1, "burst": 5}},
+    "x": {"app": {"rate": 5, "burst": 20}, "account": {"rate": 1, "burst": 5}},
+    "tiktok": {"app": {"rate": 2, "burst": 10}, "account": {"rate": 0.5, "burst": 3}},
+}
+RATE_LIMIT_MAX_WAIT = 30
+RATE_LIMIT_DEFAULT_BACKOFF = 60
+# Breakers per platform endpoint family (auth, media, publish) open for
+# CIRCUIT_BREAKER_OPEN_SECONDS once at least CIRCUIT_BREAKER_MIN_REQUESTS calls
+# in the last one to two windows failed at CIRCUIT_BREAKER_ERROR_RATE or more.
+CIRCUIT_BREAKER_REDIS_URL = RATE_LIMIT_REDIS_URL
+CIRCUIT_BREAKER_WINDOW = 60
+CIRCUIT_BREAKER_MIN_REQUESTS = 10
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+CIRCUIT_BREAKER_OPEN_SECONDS = 120
+CIRCUIT_BREAKER_PROBE_TIMEOUT = 30
+
+STATUS_WRITER_MAX_BATCH = 100
+STATUS_WRITER_FLUSH_INTERVAL = 2
+PUBLISHER_CONCURRENCY = {"linkedin": 4, "x": 4, "tiktok": 2}
+PUBLISHER_DEFAULT_CONCURRENCY = 2
+PUBLISHER_QUEUE_SIZE = 100
+PUBLISHER_SUBMIT_TIMEOUT = 60
+# Posts failing with a timeout, 429 or 5xx are retried up to
+# PUBLISH_MAX_ATTEMPTS times in total, with jittered exponential backoff
+# starting at PUBLISH_RETRY_BASE_DELAY seconds. No retry message is held
+# for longer than PUBLISH_RETRY_MAX_DELAY: a post asked to wait longer (e.g. by
+# a Retry-After header) goes back to pending and is claimed again when due.
+PUBLISH_MAX_ATTEMPTS = 5
+PUBLISH_RETRY_BASE_DELAY = 30
+PUBLISH_RETRY_MAX_DELAY = 60 * 60
+
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Redis redelivers any message unacknowledged after the visibility timeout,
+# including ETA and countdown messages still waiting in a worker. It must stay
+# well above the longest delay a message is sent with (PUBLISH_RETRY_MAX_DELAY)
+# or a delayed post is handed to a second worker.
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 4 * PUBLISH_RETRY_MAX_DELAY}
+# Publishing tasks go to one queue per platform so a slow or rate limited
+# platform cannot hold up the others; everything else uses the default queue.
+# A worker started without -Q consumes every queue declared here, the same as:
+#   celery -A digitalplatform worker -Q celery,linkedin,x,tiktok
+# To give each platform its own workers, start one worker per queue instead:
+#   celery -A digitalplatform worker -Q celery
+#   celery -A digitalplatform worker -Q linkedin
+#   celery -A digitalplatform worker -Q x
+#   celery -A digitalplatform worker -Q tiktok
+CELERY_TASK_DEFAULT_QUEUE = "celery"
+CELERY_TASK_QUEUES = [
+    Queue(name, Exchange(name), routing_key=name)
+    for name in ["celery", "linkedin", "x", "tiktok"]
+]
+CELERY_TASK_ROUTES = {
+    "socialmedia.tasks.check_x_media_processing": {"queue": "x"},
+}
 CELERY_BEAT_SCHEDULE = {
     "check_linkedin_tokens": {
         "task": "socialmedia.tasks.refresh_linkedin_tokens",
@@ -169,6 +280,14 @@ CELERY_BEAT_SCHEDULE = {
     },
     "start_social_media_posting": {
         "task": "socialmedia.tasks.start_social_media_posting",
+        "schedule": crontab(minute="*"),
+    },
+    "prefetch_scheduled_media": {
+        "task": "socialmedia.tasks.prefetch_scheduled_media",
+        "schedule": crontab(minute="*/5"),
+    },
+    "redispatch_stranded_posts": {
+        "task": "socialmedia.tasks.redispatch_stranded_posts",
         "schedule": crontab(minute="*/5"),
     },
 }
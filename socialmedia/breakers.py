@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+import redis
+import digitalplatform.settings as settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, message, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breakers per platform endpoint family, shared through Redis.
+
+    Calls are counted in fixed windows; once a family sees `min_requests` calls
+    with an error rate of at least `error_rate` over the current and previous
+    window it opens for `open_seconds`. After that it is half-open: a single
+    probe call is let through and either closes the breaker or opens it again.
+    Only timeouts, dropped connections and 5xx responses count as errors.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        window: int,
+        min_requests: int,
+        error_rate: float,
+        open_seconds: int,
+        probe_timeout: int,
+        retry_interval=30,
+    ):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.retry_interval = retry_interval
+        self._unavailable_until = 0
+        self._redis = redis.Redis.from_url(
+            redis_url, socket_timeout=1, socket_connect_timeout=1
+        )
+
+    def _key(self, platform: str, family: str):
+        return f"breaker:{platform}:{family}"
+
+    def _available(self):
+        return time.monotonic() >= self._unavailable_until
+
+    def _unavailable(self, e):
+        self._unavailable_until = time.monotonic() + self.retry_interval
+        logger.warning(f"Circuit breaker unavailable, continuing without it: {str(e)}")
+
+    def get_blocked_seconds(self, platform: str, family: str):
+        """Seconds until the breaker lets a call through, 0 if it would now."""
+        if not self._available():
+            return 0
+        key = self._key(platform, family)
+        try:
+            open_ms, tripped, probe_ms = (
+                self._redis.pipeline()
+                .pttl(f"{key}:open")
+                .exists(f"{key}:tripped")
+                .pttl(f"{key}:probe")
+                .execute()
+            )
+        except redis.RedisError as e:
+            self._unavailable(e)
+            return 0
+        if open_ms > 0:
+            return open_ms / 1000
+        if tripped and probe_ms > 0:
+            return probe_ms / 1000
+        return 0
+
+    def allow(self, platform: str, family: str):
+        """Raise CircuitOpen unless a call may go through.
+
+        Returns True when the call is the half-open probe.
+        """
+        if not self._available():
+            return False
+        key = self._key(platform, family)
+        try:
+            open_ms, tripped = (
+                self._redis.pipeline()
+                .pttl(f"{key}:open")
+                .exists(f"{key}:tripped")
+                .execute()
+            )
+            if open_ms > 0:
+                raise CircuitOpen(
+                    f"{platform} {family} circuit is open", open_ms / 1000
+                )
+            if not tripped:
+                return False
+            if self._redis.set(
+                f"{key}:probe", 1, nx=True, px=self.probe_timeout * 1000
+            ):
+                return True
+        except redis.RedisError as e:
+            self._unavailable(e)
+            return False
+        raise CircuitOpen(
+            f"{platform} {family} circuit is half-open, waiting for a probe",
+            self.probe_timeout,
+        )
+
+    def record(self, platform: str, family: str, failed: bool, is_probe=False):
+        if not self._available():
+            return
+        key = self._key(platform, family)
+        try:
+            if is_probe:
+                if failed:
+                    self._open(key)
+                else:
+                    self._redis.delete(
+                        f"{key}:tripped", f"{key}:probe", *self._window_keys(key)
+                    )
+                return
+            window_key = self._window_keys(key)[0]
+            pipe = self._redis.pipeline()
+            pipe.hincrby(window_key, "total", 1)
+            if failed:
+                pipe.hincrby(window_key, "failures", 1)
+            pipe.expire(window_key, self.window * 2)
+            for window_key in self._window_keys(key):
+                pipe.hgetall(window_key)
+            counts = pipe.execute()[-2:]
+            total = sum(int(count.get(b"total", 0)) for count in counts)
+            failures = sum(int(count.get(b"failures", 0)) for count in counts)
+            if (
+                failed
+                and total >= self.min_requests
+                and failures / total >= self.error_rate
+            ):
+                logger.warning(
+                    f"Opening {platform} {family} circuit: {failures}/{total} calls failed"
+                )
+                self._open(key)
+        except redis.RedisError as e:
+            self._unavailable(e)
+
+    def release_probe(self, platform: str, family: str):
+        try:
+            self._redis.delete(f"{self._key(platform, family)}:probe")
+        except redis.RedisError as e:
+            self._unavailable(e)
+
+    def _window_keys(self, key: str):
+        current = int(time.time() // self.window)
+        return [f"{key}:{current}", f"{key}:{current - 1}"]
+
+    def _open(self, key: str):
+        self._redis.pipeline().set(f"{key}:open", 1, px=self.open_seconds * 1000).set(
+            f"{key}:tripped", 1
+        ).delete(f"{key}:probe").execute()
+
+
+_circuit_breaker = None
+_circuit_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker():
+    global _circuit_breaker
+    with _circuit_breaker_lock:
+        if _circuit_breaker is None:
+            _circuit_breaker = CircuitBreaker(
+                redis_url=settings.CIRCUIT_BREAKER_REDIS_URL,
+                window=settings.CIRCUIT_BREAKER_WINDOW,
+                min_requests=settings.CIRCUIT_BREAKER_MIN_REQUESTS,
+                error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+                open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+                probe_timeout=settings.CIRCUIT_BREAKER_PROBE_TIMEOUT,
+            )
+        return _circuit_breaker
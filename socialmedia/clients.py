@@ -0,0 +1,220 @@
+import mmap
+import os
+import threading
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import digitalplatform.settings as settings
+from .breakers import get_circuit_breaker
+from .enums import EndpointFamily
+from .ratelimit import get_rate_limiter
+
+MEDIA_CLIENT = "media"
+
+
+class PlatformSession(requests.Session):
+    """A pooled keep-alive session that applies a default timeout to every call.
+
+    Only idempotent reads are retried by the adapter; posts and uploads are
+    never replayed automatically. Sessions created for a platform take a
+    rate-limit token before every call; pass `rate_limit_key` (the account) to
+    also apply the per-account bucket, and `endpoint_family` to route the call
+    through that family's circuit breaker. AUTH calls are made while a user
+    waits on an OAuth view, so they never wait for a token and fail with
+    RateLimitExceeded straight away.
+    """
+
+    def __init__(self, timeout, pool_size: int, retries: int, platform=None):
+        super().__init__()
+        self.timeout = timeout
+        self.platform = platform
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET", "HEAD"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        account = kwargs.pop("rate_limit_key", None)
+        family = kwargs.pop("endpoint_family", None)
+        if not self.platform:
+            return super().request(method, url, **kwargs)
+        breaker = get_circuit_breaker()
+        is_probe = family is not None and breaker.allow(self.platform, family)
+        rate_limiter = get_rate_limiter()
+        try:
+            rate_limiter.acquire(
+                self.platform,
+                account,
+                max_wait=0 if family == EndpointFamily.AUTH.value else None,
+            )
+            response = super().request(method, url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            if family:
+                breaker.record(self.platform, family, True, is_probe)
+            raise
+        except Exception:
+            if is_probe:
+                breaker.release_probe(self.platform, family)
+            raise
+        rate_limiter.update(self.platform, account, response)
+        if family:
+            breaker.record(self.platform, family, response.status_code >= 500, is_probe)
+        return response
+
+
+class ChunkSource:
+    """A staged media file, memory-mapped and handed out as upload bodies.
+
+    `slice(offset, length)` returns a body that yields `memoryview` slices of
+    the mapping, `read_size` bytes at a time, so no chunk is copied into
+    Python bytes. Pages are dropped from memory once sent, which keeps the
+    resident size of an upload flat whatever the file or chunk size.
+    """
+
+    def __init__(self, path: str, read_size: int = 1024 * 1024):
+        self.read_size = read_size
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._mmap = None
+        if self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunks(self, chunk_size: int):
+        """Return the (offset, length) of every `chunk_size` chunk of the file."""
+        return [
+            (offset, min(chunk_size, self.size - offset))
+            for offset in range(0, self.size, chunk_size)
+        ]
+
+    def slice(self, offset: int = 0, length=None):
+        if length is None:
+            length = self.size - offset
+        if offset < 0 or offset + length > self.size:
+            raise ValueError("Slice is outside the file")
+        return MappedSlice(self, offset, length)
+
+    def _iter_range(self, offset: int, length: int):
+        end = offset + length
+        with memoryview(self._mmap) as view:
+            for start in range(offset, end, self.read_size):
+                piece = view[start : min(start + self.read_size, end)]
+                try:
+                    yield piece
+                finally:
+                    piece.release()
+                self._drop_pages(start, min(start + self.read_size, end))
+
+    def _drop_pages(self, start: int, end: int):
+        # Sent pages stay in the page cache but leave this process's RSS.
+        if not hasattr(self._mmap, "madvise"):
+            return
+        page_start = start - start % mmap.PAGESIZE
+        self._mmap.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # An interrupted upload still holds a view; the mapping is
+                # unmapped once that body is garbage collected.
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MappedSlice:
+    """A request body for one byte range of a ChunkSource.
+
+    The length is known up front, so requests sends a Content-Length instead
+    of chunked encoding, and iterating again (a retry) resends the range.
+    """
+
+    def __init__(self, source: ChunkSource, offset: int, length: int):
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        if self.length:
+            yield from self.source._iter_range(self.offset, self.length)
+
+
+class MultipartBody:
+    """A multipart/form-data body around a lazily read file part.
+
+    `file_body` is any sized iterable of bytes, usually a MappedSlice, so an
+    upload never holds the file in memory. Pass the instance as `data` and
+    `headers` as the request headers.
+    """
+
+    def __init__(
+        self,
+        fields: dict,
+        file_field: str,
+        file_name: str,
+        file_body,
+        content_type="application/octet-stream",
+    ):
+        boundary = uuid.uuid4().hex
+        self.file_body = file_body
+        self.head = b"".join(
+            (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+            for name, value in fields.items()
+        ) + (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode(
+            "utf-8"
+        )
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    def __len__(self):
+        return len(self.head) + len(self.file_body) + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        yield from self.file_body
+        yield self.tail
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name: str):
+    """Return the shared session for a platform name or for media downloads."""
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = PlatformSession(
+                timeout=settings.HTTP_TIMEOUT,
+                pool_size=settings.HTTP_POOL_SIZE,
+                retries=settings.HTTP_RETRIES,
+                platform=None if name == MEDIA_CLIENT else name,
+            )
+        return _sessions[name]
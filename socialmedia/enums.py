@@ -7,6 +7,7 @@ class PostStatus(Enum):
     PROCESSED = "processed"
     POSTED = "posted"
     ERROR = "error"
+    RETRYING = "retrying"
 
     @classmethod
     def values(cls):
@@ -45,3 +46,31 @@ class Platforms(Enum):
     @classmethod
     def choices(cls):
         return [(platform.name, platform.value) for platform in cls]
+
+
+class EndpointFamily(Enum):
+    AUTH = "auth"
+    MEDIA = "media"
+    PUBLISH = "publish"
+
+    @classmethod
+    def values(cls):
+        return [family.value for family in cls]
+
+    @classmethod
+    def choices(cls):
+        return [(family.name, family.value) for family in cls]
+
+
+class ScheduledPostState(Enum):
+    PENDING = "pending"
+    DISPATCHED = "dispatched"
+    CANCELLED = "cancelled"
+
+    @classmethod
+    def values(cls):
+        return [state.value for state in cls]
+
+    @classmethod
+    def choices(cls):
+        return [(state.name, state.value) for state in cls]
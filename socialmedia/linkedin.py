@@ -1,10 +1,12 @@
-import requests
 import digitalplatform.settings as settings
 from .models import Linkedin, PostedContent
 from datetime import datetime, timedelta
-from .enums import PostStatus
-import uuid
-import os
+from .enums import EndpointFamily, PostStatus, Platforms
+from .clients import ChunkSource, get_session
+from .media import media_store
+from .breakers import CircuitOpen
+from .ratelimit import RateLimitExceeded
+from .status import set_post_status
 
 
 def authorize_user_linkedin(code: str):
@@ -19,7 +21,9 @@ def authorize_user_linkedin(code: str):
         "redirect_uri": settings.LINKEDIN_REDIRECT_URL,
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    get_access_and_refresh_tokens = requests.post(url, data=data, headers=headers)
+    get_access_and_refresh_tokens = get_session(Platforms.LINKEDIN.value).post(
+        url, data=data, headers=headers, endpoint_family=EndpointFamily.AUTH.value
+    )
     try:
         get_access_and_refresh_tokens.raise_for_status()
     except Exception as e:
@@ -36,9 +40,13 @@ def get_user_linkedin_profile(access_token: str):
     }
 
     try:
-        user_info_response = requests.get(
-            f"{settings.LINKEDIN_API_URL}v2/userinfo", headers=headers
+        user_info_response = get_session(Platforms.LINKEDIN.value).get(
+            f"{settings.LINKEDIN_API_URL}v2/userinfo",
+            headers=headers,
+            endpoint_family=EndpointFamily.AUTH.value,
         )
+    except (RateLimitExceeded, CircuitOpen):
+        raise
     except Exception as e:
         print(e)
         return None
@@ -58,7 +66,13 @@ def refresh_linkedin_access_token(user_linkedin: Linkedin):
         "client_secret": settings.LINKEDIN_CLIENT_SECRET,
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    get_access_and_refresh_tokens = requests.post(url, data=data, headers=headers)
+    get_access_and_refresh_tokens = get_session(Platforms.LINKEDIN.value).post(
+        url,
+        data=data,
+        headers=headers,
+        rate_limit_key=user_linkedin.user_id,
+        endpoint_family=EndpointFamily.AUTH.value,
+    )
     try:
         get_access_and_refresh_tokens.raise_for_status()
     except Exception as e:
@@ -97,15 +111,13 @@ def create_linkedin_content_post(
             or not user_linkedin.profile_id
             or not post_content
         ):
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = (
-                "User not authenticated or LinkedIn profile not found"
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                "User not authenticated or LinkedIn profile not found",
             )
-
-            posted_content.save()
             return
-        posted_content.post_status = PostStatus.PROCESSED.value
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.PROCESSED)
         post_url = f"{settings.LINKEDIN_API_URL}v2/ugcPosts"
         post_headers = {
             "Authorization": f"Bearer {user_linkedin.access_token}",
@@ -125,31 +137,53 @@ def create_linkedin_content_post(
             "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"},
         }
 
-        post_response = requests.post(post_url, headers=post_headers, json=post_body)
+        post_response = get_session(Platforms.LINKEDIN.value).post(
+            post_url,
+            headers=post_headers,
+            json=post_body,
+            rate_limit_key=user_linkedin.user_id,
+            endpoint_family=EndpointFamily.PUBLISH.value,
+        )
 
         if post_response.status_code in [200, 201]:
-            posted_content.post_status = PostStatus.POSTED.value
-            posted_content.is_posted = True
-            posted_content.save()
+            set_post_status(posted_content, PostStatus.POSTED)
             return
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            f"Error while posting to LinkedIn ==> {post_response.text}"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"Error while posting to LinkedIn ==> {post_response.text}",
+            failure=post_response,
         )
-        posted_content.save()
         return
     except Exception as e:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            f"An error occurred while posting to LinkedIn: {e}"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"An error occurred while posting to LinkedIn: {e}",
+            failure=e,
         )
-        posted_content.save()
         return
 
 
+def upload_linkedin_image(
+    upload_url: str, access_token: str, image_path: str, user_id=None, session=None
+):
+    """PUT a local image to a registered LinkedIn upload URL in large chunks."""
+    session = session or get_session(Platforms.LINKEDIN.value)
+    with ChunkSource(image_path, read_size=settings.MEDIA_CHUNK_SIZE) as source:
+        return session.put(
+            upload_url,
+            headers={"Authorization": f"Bearer {access_token}"},
+            data=source.slice(),
+            rate_limit_key=user_id,
+            endpoint_family=EndpointFamily.MEDIA.value,
+        )
+
+
 def create_linkedin_image_post(
     user_linkedin: Linkedin, post_content: str, posted_content: PostedContent, url: str
 ):
+    image_path = None
     try:
         if (
             not user_linkedin.access_token
@@ -157,22 +191,14 @@ def create_linkedin_image_post(
             or not url
             or not user_linkedin.is_authenticated
         ):
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = (
-                "User not authenticated or LinkedIn profile not found"
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                "User not authenticated or LinkedIn profile not found",
             )
-            posted_content.save()
             return
         access_token = user_linkedin.access_token
-        image_file = requests.get(url)
-        image_filename = f"{uuid.uuid4()}.jpg"
-        save_dir = os.path.join(settings.BASE_DIR, "LinkedIn_images")
-        os.makedirs(save_dir, exist_ok=True)
-        image_path = os.path.join(save_dir, image_filename)
-
-        with open(image_path, "wb+") as destination:
-            for chunk in image_file.iter_content():
-                destination.write(chunk)
+        image_path = media_store.acquire(url)
 
         register_upload_url = (
             f"{settings.LINKEDIN_API_URL}v2/assets?action=registerUpload"
@@ -194,15 +220,20 @@ def create_linkedin_image_post(
             }
         }
 
-        register_response = requests.post(
-            register_upload_url, headers=register_headers, json=register_body
+        register_response = get_session(Platforms.LINKEDIN.value).post(
+            register_upload_url,
+            headers=register_headers,
+            json=register_body,
+            rate_limit_key=user_linkedin.user_id,
+            endpoint_family=EndpointFamily.MEDIA.value,
         )
         if register_response.status_code not in [200, 201]:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = (
-                f"Failed to register upload ERROR ==> {register_response.text}"
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                f"Failed to register upload ERROR ==> {register_response.text}",
+                failure=register_response,
             )
-            posted_content.save()
             return
 
         register_data = register_response.json()
@@ -211,27 +242,25 @@ def create_linkedin_image_post(
         ]["uploadUrl"]
         asset = register_data["value"]["asset"]
         if not upload_url or not asset:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Invalid upload URL or asset"
-            posted_content.save()
+            set_post_status(
+                posted_content, PostStatus.ERROR, "Invalid upload URL or asset"
+            )
             return
 
-        with open(image_path, "rb") as img_file:
-            upload_headers = {
-                "Authorization": f"Bearer {access_token}",
-            }
-            upload_response = requests.put(
-                upload_url, headers=upload_headers, data=img_file
-            )
+        upload_response = upload_linkedin_image(
+            upload_url, access_token, image_path, user_linkedin.user_id
+        )
 
         if upload_response.status_code not in [200, 201]:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Failed to upload image"
-            posted_content.save()
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                "Failed to upload image",
+                failure=upload_response,
+            )
             return
 
-        posted_content.post_status = PostStatus.PROCESSED.value
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.PROCESSED)
 
         post_url = f"{settings.LINKEDIN_API_URL}v2/ugcPosts"
         post_headers = {
@@ -259,28 +288,32 @@ def create_linkedin_image_post(
             "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"},
         }
 
-        final_post_response = requests.post(
-            post_url, headers=post_headers, json=post_body
+        final_post_response = get_session(Platforms.LINKEDIN.value).post(
+            post_url,
+            headers=post_headers,
+            json=post_body,
+            rate_limit_key=user_linkedin.user_id,
+            endpoint_family=EndpointFamily.PUBLISH.value,
         )
         if final_post_response.status_code not in [200, 201]:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = (
-                f"Failed to create LinkedIn post ==> {final_post_response.text}"
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                f"Failed to create LinkedIn post ==> {final_post_response.text}",
+                failure=final_post_response,
             )
-            posted_content.save()
             return
-        posted_content.post_status = PostStatus.POSTED.value
-        posted_content.is_posted = True
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.POSTED)
         return
     except Exception as e:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            f"An error occurred while posting to LinkedIn: {e}"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"An error occurred while posting to LinkedIn: {e}",
+            failure=e,
         )
-        posted_content.save()
         return
 
     finally:
-        if os.path.isfile(image_path):
-            os.remove(image_path)
+        if image_path:
+            media_store.release(url)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+import requests
+from django.core.management.base import BaseCommand
+import digitalplatform.settings as settings
+from socialmedia.clients import PlatformSession
+from socialmedia.linkedin import upload_linkedin_image
+from socialmedia.media import MediaStore
+from socialmedia.models import CachedMedia
+
+
+def run_stand_in_server(port: int, size: int):
+    """Serve source images and accept LinkedIn-style upload PUTs on localhost."""
+    payload = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            view = memoryview(payload)
+            for start in range(0, size, 1024 * 1024):
+                self.wfile.write(view[start : start + 1024 * 1024])
+
+        def do_PUT(self):
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0:
+                remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the LinkedIn image fetch and upload path against a local "
+        "stand-in server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=5)
+        parser.add_argument("--size-mb", type=float, default=5)
+        parser.add_argument("--port", type=int, default=8799)
+
+    def handle(self, *args, **options):
+        size = int(options["size_mb"] * 1024 * 1024)
+        base_url = f"http://127.0.0.1:{options['port']}"
+        server = Process(
+            target=run_stand_in_server, args=(options["port"], size), daemon=True
+        )
+        server.start()
+        root = tempfile.mkdtemp()
+        try:
+            self.wait_for_server(base_url)
+            session = PlatformSession(
+                timeout=settings.HTTP_TIMEOUT,
+                pool_size=settings.HTTP_POOL_SIZE,
+                retries=0,
+            )
+            store = MediaStore(
+                root=root,
+                max_bytes=settings.MEDIA_CACHE_MAX_BYTES,
+                max_age=timedelta(hours=1),
+                lease=timedelta(hours=1),
+            )
+            images = [f"{base_url}/media/{i}.jpg" for i in range(options["images"])]
+            upload_url = f"{base_url}/upload"
+
+            def legacy(url):
+                # The previous path: unstreamed GET, one-byte iter_content writes.
+                image_file = requests.get(url)
+                image_path = os.path.join(root, "legacy.jpg")
+                with open(image_path, "wb+") as destination:
+                    for chunk in image_file.iter_content():
+                        destination.write(chunk)
+                with open(image_path, "rb") as img_file:
+                    response = requests.put(upload_url, data=img_file)
+                os.remove(image_path)
+                return response
+
+            def media_store(url):
+                with store.open(url) as image_path:
+                    return upload_linkedin_image(
+                        upload_url, "token", image_path, session=session
+                    )
+
+            self.report("legacy", legacy, images, size)
+            self.report("media store, cold", media_store, images, size)
+            self.report("media store, prefetched", media_store, images, size)
+        finally:
+            CachedMedia.objects.filter(url__startswith=base_url).delete()
+            shutil.rmtree(root, ignore_errors=True)
+            server.terminate()
+
+    def wait_for_server(self, base_url: str):
+        for _ in range(50):
+            try:
+                requests.put(f"{base_url}/upload", data=b"", timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError("Stand-in server did not start")
+
+    def report(self, name: str, upload, images: list, size: int):
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        for url in images:
+            response = upload(url)
+            if response.status_code != 201:
+                raise RuntimeError(f"{name}: upload failed with {response.status_code}")
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        megabytes = size * len(images) / (1024 * 1024)
+        self.stdout.write(
+            f"{name:>24}: {megabytes / elapsed:8.1f} MB/s, "
+            f"{elapsed / len(images) * 1000:8.1f} ms and "
+            f"{cpu / len(images) * 1000:8.1f} ms CPU per image"
+        )
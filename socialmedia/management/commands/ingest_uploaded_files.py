@@ -0,0 +1,53 @@
+import hashlib
+import os
+from django.core.management.base import BaseCommand
+from socialmedia.models import UserUploadedFiles
+from socialmedia.enums import Platforms
+from socialmedia.schedules import read_schedule_file, ingest_schedule
+
+
+def get_file_hash(file_path: str):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as schedule_file:
+        for chunk in iter(lambda: schedule_file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Ingest schedules from previously uploaded CSV files into scheduled posts."
+
+    def handle(self, *args, **options):
+        file_fields = {
+            Platforms.LINKEDIN.value: "linkedin_file_path",
+            Platforms.X.value: "x_file_path",
+            Platforms.INSTAGRAM.value: "instagram_file_path",
+            Platforms.TIKTOK.value: "tiktok_file_path",
+        }
+        parsed_files = {}
+        total = 0
+        for user_files in UserUploadedFiles.objects.select_related("user"):
+            # An is_same upload points every platform at one file: parse it once.
+            platforms_by_path = {}
+            for platform_name, field in file_fields.items():
+                file_path = getattr(user_files, field)
+                if file_path and os.path.exists(file_path):
+                    platforms_by_path.setdefault(file_path, []).append(platform_name)
+            for file_path, platform_names in platforms_by_path.items():
+                try:
+                    file_hash = get_file_hash(file_path)
+                    if file_hash not in parsed_files:
+                        parsed_files[file_hash] = read_schedule_file(file_path)
+                    created, errors, _ = ingest_schedule(
+                        user_files.user, platform_names, parsed_files[file_hash]
+                    )
+                    total += created
+                    if errors:
+                        self.stderr.write(
+                            f"Rejected {len(errors)} rows of {file_path} for user {user_files.user.username}."
+                        )
+                except Exception as e:
+                    self.stderr.write(
+                        f"Error ingesting {file_path} for user {user_files.user.username}: {e}"
+                    )
+        self.stdout.write(f"Ingested {total} scheduled posts.")
@@ -0,0 +1,221 @@
+import fcntl
+import hashlib
+import mimetypes
+import os
+import socket
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from django.db.models import F, Q
+from django.utils import timezone
+import digitalplatform.settings as settings
+from .clients import get_session, MEDIA_CLIENT
+from .models import CachedMedia
+from .retries import PublishError
+
+
+class MediaStore:
+    """Content-addressed store of downloaded post media, shared by all publishers.
+
+    Files are named by the SHA-256 of their content, so one image posted to
+    several platforms (or retried) is downloaded once. Each source URL has a
+    CachedMedia row holding its ETag, a reference count and the time it was
+    last used. A per-URL file lock makes concurrent publishers wait for a
+    single download. Unreferenced entries are evicted least recently used
+    first once the store is over `max_bytes`.
+
+    The files live on local disk, so the rows are kept per `host` and each
+    host only sees its own. A lease taken on one host is released there.
+    """
+
+    def __init__(self, root, max_bytes: int, max_age, lease, host=None):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lease = lease
+        self.host = host or socket.gethostname()
+
+    def _entries(self):
+        return CachedMedia.objects.filter(host=self.host)
+
+    def get_path(self, media: CachedMedia):
+        return os.path.join(self.root, media.file_name)
+
+    @contextmanager
+    def _lock(self, url_hash: str):
+        lock_dir = os.path.join(self.root, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, url_hash), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire(self, url: str):
+        """Return the local path of `url`'s media, downloading it if needed.
+
+        Every acquire must be paired with a `release` of the same URL.
+        """
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self._lock(url_hash):
+            media = self._entries().filter(url_hash=url_hash).first()
+            if not media or not os.path.isfile(self.get_path(media)):
+                media = self._download(url, url_hash, media, revalidate=False)
+            elif timezone.now() - media.verified_on > self.max_age:
+                media = self._download(url, url_hash, media, revalidate=True)
+            CachedMedia.objects.filter(pk=media.pk).update(
+                refcount=F("refcount") + 1, last_used_at=timezone.now()
+            )
+        self.evict()
+        return self.get_path(media)
+
+    def retain(self, url: str):
+        """Take another reference to media that is already in the store."""
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        self._entries().filter(url_hash=url_hash).update(
+            refcount=F("refcount") + 1, last_used_at=timezone.now()
+        )
+
+    def release(self, url: str, host=None):
+        """Give back a reference, taken on `host` if it was not this one."""
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        CachedMedia.objects.filter(
+            host=host or self.host, url_hash=url_hash, refcount__gt=0
+        ).update(refcount=F("refcount") - 1, last_used_at=timezone.now())
+
+    @contextmanager
+    def open(self, url: str):
+        path = self.acquire(url)
+        try:
+            yield path
+        finally:
+            self.release(url)
+
+    def _download(self, url: str, url_hash: str, media, revalidate: bool):
+        headers = {}
+        if revalidate and media.etag:
+            headers["If-None-Match"] = media.etag
+        response = get_session(MEDIA_CLIENT).get(url, headers=headers, stream=True)
+        with response:
+            if response.status_code == 304:
+                media.verified_on = timezone.now()
+                media.save(update_fields=["verified_on"])
+                return media
+            if response.status_code != 200:
+                raise PublishError(
+                    f"Failed to download media, status code: {response.status_code}",
+                    response,
+                )
+            os.makedirs(self.root, exist_ok=True)
+            temp_path = os.path.join(self.root, f".{uuid.uuid4()}.part")
+            content_hash = hashlib.sha256()
+            size = 0
+            try:
+                with open(temp_path, "wb") as media_file:
+                    for chunk in response.iter_content(
+                        chunk_size=settings.MEDIA_CHUNK_SIZE
+                    ):
+                        media_file.write(chunk)
+                        content_hash.update(chunk)
+                        size += len(chunk)
+                content_hash = content_hash.hexdigest()
+                file_name = content_hash + self._get_extension(url, response)
+                os.replace(temp_path, os.path.join(self.root, file_name))
+            finally:
+                if os.path.isfile(temp_path):
+                    os.remove(temp_path)
+        now = timezone.now()
+        fields = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "content_hash": content_hash,
+            "file_name": file_name,
+            "size": size,
+            "verified_on": now,
+        }
+        previous = media
+        media, _ = CachedMedia.objects.update_or_create(
+            host=self.host,
+            url_hash=url_hash,
+            defaults=fields,
+            create_defaults={**fields, "last_used_at": now},
+        )
+        # The source changed: drop the old file unless a publisher still reads it.
+        if (
+            previous
+            and previous.file_name != file_name
+            and not previous.refcount
+            and not self._entries().filter(file_name=previous.file_name).exists()
+        ):
+            old_path = self.get_path(previous)
+            if os.path.isfile(old_path):
+                os.remove(old_path)
+        return media
+
+    def _get_extension(self, url: str, response):
+        # Publishers pick the upload flow and MIME type from the file extension.
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension:
+            return extension
+        content_type = response.headers.get("Content-Type", "").split(";")[0]
+        return mimetypes.guess_extension(content_type) or ""
+
+    def get_size(self):
+        files = self._entries().values_list("file_name", "size").distinct()
+        return sum(size for _, size in files)
+
+    def evict(self):
+        """Delete released entries, least recently used first, until under budget."""
+        total = self.get_size()
+        if total <= self.max_bytes:
+            return
+        candidates = (
+            self._entries()
+            .filter(Q(refcount=0) | Q(last_used_at__lt=timezone.now() - self.lease))
+            .order_by("last_used_at")
+        )
+        for media in candidates:
+            if total <= self.max_bytes:
+                break
+            with self._lock(media.url_hash):
+                deleted, _ = (
+                    CachedMedia.objects.filter(pk=media.pk)
+                    .filter(
+                        Q(refcount=0) | Q(last_used_at__lt=timezone.now() - self.lease)
+                    )
+                    .delete()
+                )
+                if not deleted:
+                    continue
+                if self._entries().filter(file_name=media.file_name).exists():
+                    continue
+                path = self.get_path(media)
+                if os.path.isfile(path):
+                    os.remove(path)
+                total -= media.size
+
+    def stats(self):
+        return {
+            "entries": self._entries().count(),
+            "bytes": self.get_size(),
+            "in_use": self._entries().filter(refcount__gt=0).count(),
+        }
+
+
+def validate_media(path: str, post_type: str):
+    """Return why a downloaded file cannot be posted as `post_type`, or None."""
+    if not os.path.getsize(path):
+        return "Media file is empty"
+    mime_type, _ = mimetypes.guess_type(path)
+    if mime_type and not mime_type.startswith(f"{post_type}/"):
+        return f"Media file is {mime_type}, expected a {post_type}"
+    return None
+
+
+media_store = MediaStore(
+    root=settings.MEDIA_CACHE_DIR,
+    max_bytes=settings.MEDIA_CACHE_MAX_BYTES,
+    max_age=settings.MEDIA_CACHE_MAX_AGE,
+    lease=settings.MEDIA_CACHE_LEASE,
+)
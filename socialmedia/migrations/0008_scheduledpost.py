@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialmedia', '0007_alter_tiktok_token_expires_on'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('platform_name', models.CharField(choices=[('LINKEDIN', 'linkedin'), ('INSTAGRAM', 'instagram'), ('TIKTOK', 'tiktok'), ('X', 'x')], max_length=100)),
+                ('scheduled_at', models.DateTimeField()),
+                ('post_id', models.IntegerField(blank=True, null=True)),
+                ('post_type', models.CharField(choices=[('TEXT', 'text'), ('IMAGE', 'image'), ('VIDEO', 'video'), ('ARTICLE', 'article')], default='text', max_length=20)),
+                ('content', models.TextField(blank=True, null=True)),
+                ('url', models.CharField(blank=True, max_length=1000, null=True)),
+                ('state', models.CharField(choices=[('PENDING', 'pending'), ('DISPATCHED', 'dispatched'), ('CANCELLED', 'cancelled')], default='pending', max_length=20)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scheduled_at'], name='scheduled_post_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialmedia', '0009_postclaim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postedcontent',
+            name='scheduled_post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='socialmedia.scheduledpost'),
+        ),
+    ]
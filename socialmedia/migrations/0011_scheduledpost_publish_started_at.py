@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialmedia', '0010_postedcontent_scheduled_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledpost',
+            name='publish_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
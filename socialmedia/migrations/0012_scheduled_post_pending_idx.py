@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialmedia', '0011_scheduledpost_publish_started_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='scheduledpost',
+            name='scheduled_post_at_idx',
+        ),
+        migrations.AddIndex(
+            model_name='scheduledpost',
+            index=models.Index(condition=models.Q(('state', 'pending')), fields=['scheduled_at'], name='scheduled_post_pending_idx'),
+        ),
+    ]
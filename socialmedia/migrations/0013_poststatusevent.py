@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0012_scheduled_post_pending_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PostStatusEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "post_status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "pending"),
+                            ("STARTED", "started"),
+                            ("PROCESSED", "processed"),
+                            ("POSTED", "posted"),
+                            ("ERROR", "error"),
+                        ]
+                    ),
+                ),
+                (
+                    "error_reason",
+                    models.CharField(blank=True, max_length=1000, null=True),
+                ),
+                ("created_on", models.DateTimeField()),
+                (
+                    "posted_content",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="socialmedia.postedcontent",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0013_poststatusevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="postedcontent",
+            name="post_status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "pending"),
+                    ("STARTED", "started"),
+                    ("PROCESSED", "processed"),
+                    ("POSTED", "posted"),
+                    ("ERROR", "error"),
+                    ("RETRYING", "retrying"),
+                ],
+                default="pending",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="poststatusevent",
+            name="post_status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "pending"),
+                    ("STARTED", "started"),
+                    ("PROCESSED", "processed"),
+                    ("POSTED", "posted"),
+                    ("ERROR", "error"),
+                    ("RETRYING", "retrying"),
+                ]
+            ),
+        ),
+    ]
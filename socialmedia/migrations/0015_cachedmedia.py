@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0014_scheduledpost_retry_attempts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedMedia",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url_hash", models.CharField(max_length=64, unique=True)),
+                ("url", models.CharField(max_length=1000)),
+                ("etag", models.CharField(blank=True, max_length=255, null=True)),
+                ("content_hash", models.CharField(max_length=64)),
+                ("file_name", models.CharField(max_length=100)),
+                ("size", models.BigIntegerField()),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("last_used_at", models.DateTimeField()),
+                ("verified_on", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0015_cachedmedia"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="media_prefetched_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0016_scheduledpost_media_prefetched_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("platform_name", models.CharField(max_length=100)),
+                ("media_url", models.CharField(max_length=1000)),
+                ("file_path", models.CharField(max_length=500)),
+                ("file_size", models.BigIntegerField()),
+                (
+                    "upload_url",
+                    models.CharField(blank=True, max_length=1000, null=True),
+                ),
+                ("media_id", models.CharField(blank=True, max_length=100, null=True)),
+                ("chunk_size", models.BigIntegerField()),
+                ("total_chunks", models.PositiveIntegerField()),
+                ("acknowledged_chunks", models.PositiveIntegerField(default=0)),
+                ("expires_at", models.DateTimeField()),
+                ("created_on", models.DateTimeField(auto_now_add=True)),
+                ("updated_on", models.DateTimeField(auto_now=True)),
+                (
+                    "posted_content",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_session",
+                        to="socialmedia.postedcontent",
+                    ),
+                ),
+            ],
+        ),
+    ]
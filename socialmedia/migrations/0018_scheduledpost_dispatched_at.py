@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0017_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="dispatched_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:32
+
+import socialmedia.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("socialmedia", "0018_scheduledpost_dispatched_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cachedmedia",
+            name="host",
+            field=models.CharField(
+                default=socialmedia.models.get_host_name, max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="media_prefetch_host",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="uploadsession",
+            name="host",
+            field=models.CharField(
+                default=socialmedia.models.get_host_name, max_length=255
+            ),
+        ),
+        migrations.AlterField(
+            model_name="cachedmedia",
+            name="url_hash",
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name="cachedmedia",
+            constraint=models.UniqueConstraint(
+                fields=("host", "url_hash"), name="unique_cached_media"
+            ),
+        ),
+    ]
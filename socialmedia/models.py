@@ -1,8 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import User
+import socket
 import uuid
 from datetime import datetime
-from .enums import PostStatus, PostType
+from .enums import PostStatus, PostType, Platforms, ScheduledPostState
+
+
+def get_host_name():
+    return socket.gethostname()
 
 
 class Linkedin(models.Model):
@@ -65,6 +70,9 @@ class PostedContent(models.Model):
     is_posted = models.BooleanField(default=False)
     error_reason = models.CharField(max_length=1000, null=True, blank=True)
     platform_name = models.CharField(max_length=100, null=False, blank=False)
+    scheduled_post = models.ForeignKey(
+        "ScheduledPost", on_delete=models.SET_NULL, null=True, blank=True
+    )
 
 
 class UserUploadedFiles(models.Model):
@@ -73,3 +81,108 @@ class UserUploadedFiles(models.Model):
     x_file_path = models.CharField(max_length=500, null=True, blank=True)
     instagram_file_path = models.CharField(max_length=500, null=True, blank=True)
     tiktok_file_path = models.CharField(max_length=500, null=True, blank=True)
+
+
+class ScheduledPost(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    platform_name = models.CharField(
+        max_length=100, choices=Platforms.choices(), null=False, blank=False
+    )
+    scheduled_at = models.DateTimeField(null=False, blank=False)
+    post_id = models.IntegerField(null=True, blank=True)
+    post_type = models.CharField(
+        max_length=20,
+        default=PostType.TEXT.value,
+        choices=PostType.choices(),
+        null=False,
+        blank=False,
+    )
+    content = models.TextField(null=True, blank=True)
+    url = models.CharField(max_length=1000, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    publish_started_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    media_prefetched_at = models.DateTimeField(null=True, blank=True)
+    # The media store is local to each host; the prefetch lease is held there.
+    media_prefetch_host = models.CharField(max_length=255, null=True, blank=True)
+    state = models.CharField(
+        max_length=20,
+        default=ScheduledPostState.PENDING.value,
+        choices=ScheduledPostState.choices(),
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["scheduled_at"],
+                condition=models.Q(state=ScheduledPostState.PENDING.value),
+                name="scheduled_post_pending_idx",
+            ),
+        ]
+
+
+class PostClaim(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    platform_name = models.CharField(max_length=100, null=False, blank=False)
+    content_hash = models.CharField(max_length=64, null=False, blank=False)
+    scheduled_at = models.DateTimeField(null=False, blank=False)
+    scheduled_post = models.ForeignKey(
+        ScheduledPost, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    claimed_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "platform_name", "content_hash", "scheduled_at"],
+                name="unique_post_claim",
+            ),
+        ]
+
+
+class PostStatusEvent(models.Model):
+    posted_content = models.ForeignKey(PostedContent, on_delete=models.CASCADE)
+    post_status = models.CharField(choices=PostStatus.choices())
+    error_reason = models.CharField(max_length=1000, null=True, blank=True)
+    created_on = models.DateTimeField()
+
+
+class CachedMedia(models.Model):
+    host = models.CharField(max_length=255, default=get_host_name)
+    url_hash = models.CharField(max_length=64)
+    url = models.CharField(max_length=1000)
+    etag = models.CharField(max_length=255, null=True, blank=True)
+    content_hash = models.CharField(max_length=64)
+    file_name = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField()
+    verified_on = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["host", "url_hash"], name="unique_cached_media"
+            ),
+        ]
+
+
+class UploadSession(models.Model):
+    posted_content = models.OneToOneField(
+        PostedContent, on_delete=models.CASCADE, related_name="upload_session"
+    )
+    host = models.CharField(max_length=255, default=get_host_name)
+    platform_name = models.CharField(max_length=100, null=False, blank=False)
+    media_url = models.CharField(max_length=1000)
+    file_path = models.CharField(max_length=500)
+    file_size = models.BigIntegerField()
+    upload_url = models.CharField(max_length=1000, null=True, blank=True)
+    media_id = models.CharField(max_length=100, null=True, blank=True)
+    chunk_size = models.BigIntegerField()
+    total_chunks = models.PositiveIntegerField()
+    acknowledged_chunks = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField()
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
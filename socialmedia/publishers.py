@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+import digitalplatform.settings as settings
+
+logger = logging.getLogger(__name__)
+
+
+class PublisherQueueFull(Exception):
+    pass
+
+
+class PublisherPool:
+    """Shared executor for publisher functions with a bounded queue per platform.
+
+    Each platform gets its own worker threads (`concurrency`) and at most
+    `queue_size` waiting jobs; `submit` blocks once a platform is full.
+    `schedule` holds jobs until they are due on a single timer thread, so
+    posts waiting for their time cost no worker threads or queue slots.
+    """
+
+    def __init__(self, concurrency: dict, default_concurrency: int = 2, queue_size=100):
+        self.concurrency = concurrency
+        self.default_concurrency = default_concurrency
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._slots = {}
+        self._stats = {}
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._scheduled_changed = threading.Condition()
+        self._timer = None
+        self._shutting_down = False
+
+    def _get_platform(self, platform: str):
+        with self._lock:
+            if platform not in self._executors:
+                workers = self.concurrency.get(platform, self.default_concurrency)
+                self._executors[platform] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=f"publisher-{platform}"
+                )
+                self._slots[platform] = threading.BoundedSemaphore(
+                    workers + self.queue_size
+                )
+                self._stats[platform] = {
+                    "scheduled": 0,
+                    "queued": 0,
+                    "in_flight": 0,
+                    "completed": 0,
+                    "failed": 0,
+                    "rejected": 0,
+                }
+            return self._executors[platform], self._slots[platform]
+
+    def submit(self, platform: str, fn, *args, timeout=None, **kwargs):
+        executor, slots = self._get_platform(platform)
+        if not slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats[platform]["rejected"] += 1
+            raise PublisherQueueFull(f"Publisher queue for {platform} is full")
+        return self._enqueue(platform, executor, slots, fn, args, kwargs)
+
+    def _enqueue(self, platform: str, executor, slots, fn, args, kwargs):
+        with self._lock:
+            self._stats[platform]["queued"] += 1
+        try:
+            return executor.submit(self._run, platform, slots, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._stats[platform]["queued"] -= 1
+            slots.release()
+            raise
+
+    def schedule(self, platform: str, delay: float, fn, *args, **kwargs):
+        """Submit `fn` to the platform's workers once `delay` seconds have passed.
+
+        A due job that finds its platform full stays on the timer thread and is
+        tried again every second. Jobs still waiting when the process exits are
+        lost.
+        """
+        self._get_platform(platform)
+        with self._lock:
+            self._stats[platform]["scheduled"] += 1
+        self._push(time.monotonic() + max(delay, 0), platform, fn, args, kwargs)
+
+    def _push(self, run_at: float, platform: str, fn, args, kwargs):
+        with self._scheduled_changed:
+            heapq.heappush(
+                self._scheduled,
+                (run_at, next(self._sequence), platform, fn, args, kwargs),
+            )
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._submit_due_jobs, name="publisher-timer", daemon=True
+                )
+                self._timer.start()
+            self._scheduled_changed.notify()
+
+    def _submit_due_jobs(self):
+        while True:
+            with self._scheduled_changed:
+                while not self._shutting_down and (
+                    not self._scheduled or self._scheduled[0][0] > time.monotonic()
+                ):
+                    timeout = None
+                    if self._scheduled:
+                        timeout = self._scheduled[0][0] - time.monotonic()
+                    self._scheduled_changed.wait(timeout)
+                if self._shutting_down:
+                    return
+                _, _, platform, fn, args, kwargs = heapq.heappop(self._scheduled)
+            executor, slots = self._get_platform(platform)
+            if not slots.acquire(blocking=False):
+                self._push(time.monotonic() + 1, platform, fn, args, kwargs)
+                continue
+            with self._lock:
+                self._stats[platform]["scheduled"] -= 1
+            try:
+                self._enqueue(platform, executor, slots, fn, args, kwargs)
+            except Exception:
+                logger.exception(f"Error submitting a scheduled {platform} job")
+
+    def _run(self, platform: str, slots, fn, args, kwargs):
+        stats = self._stats[platform]
+        with self._lock:
+            stats["queued"] -= 1
+            stats["in_flight"] += 1
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            close_old_connections()
+            with self._lock:
+                stats["in_flight"] -= 1
+                stats["failed" if failed else "completed"] += 1
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {platform: dict(stats) for platform, stats in self._stats.items()}
+
+    def shutdown(self, wait: bool = True):
+        with self._scheduled_changed:
+            self._shutting_down = True
+            self._scheduled_changed.notify()
+        with self._lock:
+            executors = list(self._executors.values())
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+
+_publisher_pool = None
+_publisher_pool_lock = threading.Lock()
+
+
+def get_publisher_pool():
+    global _publisher_pool
+    with _publisher_pool_lock:
+        if _publisher_pool is None:
+            _publisher_pool = PublisherPool(
+                concurrency=settings.PUBLISHER_CONCURRENCY,
+                default_concurrency=settings.PUBLISHER_DEFAULT_CONCURRENCY,
+                queue_size=settings.PUBLISHER_QUEUE_SIZE,
+            )
+        return _publisher_pool
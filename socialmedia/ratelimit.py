@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import redis
+import digitalplatform.settings as settings
+
+logger = logging.getLogger(__name__)
+
+# KEYS holds (bucket, block) key pairs and ARGV the (rate, burst) of each pair.
+# A token is taken from every bucket or from none, using the Redis clock so all
+# workers agree on refills. Returns the seconds to wait, "0" once acquired.
+ACQUIRE_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i = 1, #KEYS / 2 do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local blocked = redis.call("PTTL", KEYS[2 * i])
+    if blocked > 0 then
+        wait = math.max(wait, blocked / 1000)
+    end
+    local bucket = redis.call("HMGET", KEYS[2 * i - 1], "tokens", "ts")
+    local available = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - updated) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait == 0 then
+    for i = 1, #KEYS / 2 do
+        local rate = tonumber(ARGV[2 * i - 1])
+        local burst = tonumber(ARGV[2 * i])
+        redis.call("HSET", KEYS[2 * i - 1], "tokens", tokens[i] - 1, "ts", now)
+        redis.call("EXPIRE", KEYS[2 * i - 1], math.ceil(burst / rate) + 1)
+    end
+end
+return tostring(wait)
+"""
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_block_seconds(response):
+    """Return how long a response asks us to back off, or 0.
+
+    Understands `Retry-After` (seconds or an HTTP date) and X's
+    `x-rate-limit-remaining`/`x-rate-limit-reset` pair. A 429 without either
+    header backs off for RATE_LIMIT_DEFAULT_BACKOFF seconds.
+    """
+    headers = response.headers
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(
+                    0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()
+                )
+            except (TypeError, ValueError):
+                pass
+    remaining = headers.get("x-rate-limit-remaining")
+    reset = headers.get("x-rate-limit-reset")
+    if remaining == "0" and reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    if response.status_code == 429:
+        return float(settings.RATE_LIMIT_DEFAULT_BACKOFF)
+    return 0.0
+
+
+class RateLimiter:
+    """Token buckets per platform app and per account, shared through Redis.
+
+    `acquire` takes a token from the platform's app bucket and, when an account
+    is given, from that account's bucket, waiting up to `max_wait` seconds.
+    `update` blocks a bucket for as long as a platform response asks. If Redis
+    is unreachable calls go through unlimited rather than failing the post, and
+    Redis is not tried again for `retry_interval` seconds.
+    """
+
+    def __init__(
+        self, redis_url: str, limits: dict, max_wait: float, retry_interval=30
+    ):
+        self.limits = limits
+        self.max_wait = max_wait
+        self.retry_interval = retry_interval
+        self._unavailable_until = 0
+        self._redis = redis.Redis.from_url(
+            redis_url, socket_timeout=1, socket_connect_timeout=1
+        )
+        self._acquire_script = self._redis.register_script(ACQUIRE_SCRIPT)
+
+    def _scopes(self, platform: str, account=None):
+        limits = self.limits.get(platform)
+        if not limits or time.monotonic() < self._unavailable_until:
+            return []
+        scopes = [(f"ratelimit:{platform}:app", limits["app"])]
+        if account is not None and "account" in limits:
+            scopes.append(
+                (f"ratelimit:{platform}:account:{account}", limits["account"])
+            )
+        return scopes
+
+    def acquire(self, platform: str, account=None, max_wait=None):
+        scopes = self._scopes(platform, account)
+        if not scopes:
+            return
+        keys = []
+        args = []
+        for key, limit in scopes:
+            keys.extend([key, f"{key}:blocked"])
+            args.extend([limit["rate"], limit["burst"]])
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            try:
+                wait = float(self._acquire_script(keys=keys, args=args))
+            except redis.RedisError as e:
+                self._unavailable_until = time.monotonic() + self.retry_interval
+                logger.warning(
+                    f"Rate limiter unavailable, continuing without it: {str(e)}"
+                )
+                return
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(
+                    f"{platform} rate limit reached, retry in {wait:.1f}s", wait
+                )
+            time.sleep(wait)
+
+    def update(self, platform: str, account, response):
+        block_seconds = get_block_seconds(response)
+        scopes = self._scopes(platform, account)
+        if not block_seconds or not scopes:
+            return
+        # Account-level headers block only that account; app calls block the app.
+        key = scopes[-1][0]
+        try:
+            self._redis.set(f"{key}:blocked", 1, px=int(block_seconds * 1000))
+        except redis.RedisError as e:
+            self._unavailable_until = time.monotonic() + self.retry_interval
+            logger.warning(f"Failed to record {platform} rate limit: {str(e)}")
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                redis_url=settings.RATE_LIMIT_REDIS_URL,
+                limits=settings.RATE_LIMITS,
+                max_wait=settings.RATE_LIMIT_MAX_WAIT,
+            )
+        return _rate_limiter
@@ -0,0 +1,72 @@
+import random
+from datetime import timedelta
+import requests
+from django.utils import timezone
+import digitalplatform.settings as settings
+from .breakers import CircuitOpen
+from .ratelimit import RateLimitExceeded, get_block_seconds
+
+TRANSIENT_STATUS_CODES = [408, 429, 500, 502, 503, 504]
+
+
+class PublishError(Exception):
+    """A publishing step failed; `failure` is the response or error behind it."""
+
+    def __init__(self, message, failure=None):
+        super().__init__(message)
+        self.failure = failure
+
+
+def is_transient_failure(failure):
+    """Whether a failed response or raised error is worth retrying.
+
+    Timeouts, dropped connections, rate limits, open circuits and 5xx
+    responses are transient; anything else (4xx, bad content, missing
+    tokens) is permanent.
+    """
+    if isinstance(failure, PublishError):
+        return is_transient_failure(failure.failure)
+    if isinstance(failure, requests.Response):
+        return failure.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(
+        failure,
+        (requests.Timeout, requests.ConnectionError, RateLimitExceeded, CircuitOpen),
+    )
+
+
+def get_retry_after(failure):
+    """Return the minimum delay the platform asked for, in seconds."""
+    if isinstance(failure, PublishError):
+        return get_retry_after(failure.failure)
+    if isinstance(failure, (RateLimitExceeded, CircuitOpen)):
+        return failure.retry_after
+    if isinstance(failure, requests.Response):
+        return get_block_seconds(failure)
+    return 0
+
+
+def get_retry_delay(attempt: int, retry_after: float = 0):
+    """Exponential backoff with jitter for the given (zero-based) attempt.
+
+    The delay is drawn from the upper half of `base * 2**attempt`, capped at
+    PUBLISH_RETRY_MAX_DELAY, and never shorter than `retry_after`. Only a
+    `retry_after` can exceed the cap; the dispatcher does not hold such posts.
+    """
+    ceiling = min(
+        settings.PUBLISH_RETRY_MAX_DELAY, settings.PUBLISH_RETRY_BASE_DELAY * 2**attempt
+    )
+    return max(random.uniform(ceiling / 2, ceiling), retry_after)
+
+
+def schedule_retry(scheduled_post, failure):
+    """Record the next attempt of a transiently failed post.
+
+    Returns the delay in seconds, or None once the attempt budget is spent.
+    """
+    if scheduled_post.attempts + 1 >= settings.PUBLISH_MAX_ATTEMPTS:
+        return None
+    delay = get_retry_delay(scheduled_post.attempts, get_retry_after(failure))
+    scheduled_post.attempts += 1
+    scheduled_post.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    scheduled_post.save(update_fields=["attempts", "next_attempt_at"])
+    return delay
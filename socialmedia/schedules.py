@@ -0,0 +1,279 @@
+import hashlib
+import pandas as pd
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .media import media_store
+from .models import PostClaim, PostedContent, ScheduledPost
+from .enums import Platforms, PostType, ScheduledPostState
+
+
+def read_schedule_file(csv_path: str):
+    return pd.read_csv(csv_path, quotechar='"')
+
+
+PUBLISHING_PLATFORMS = [
+    Platforms.LINKEDIN.value,
+    Platforms.TIKTOK.value,
+    Platforms.X.value,
+]
+PLATFORM_POST_TYPES = {
+    Platforms.LINKEDIN.value: [PostType.TEXT.value, PostType.IMAGE.value],
+    Platforms.TIKTOK.value: [PostType.VIDEO.value],
+    Platforms.X.value: [
+        PostType.TEXT.value,
+        PostType.IMAGE.value,
+        PostType.VIDEO.value,
+    ],
+}
+MEDIA_POST_TYPES = [PostType.IMAGE.value, PostType.VIDEO.value]
+
+
+def _text_column(df: pd.DataFrame, column: str):
+    if column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype="string")
+    values = df[column].astype("string").str.strip()
+    return values.mask(values == "")
+
+
+def get_content_hash(post_type, content, url):
+    row_identity = "\x1f".join(str(value or "") for value in (post_type, content, url))
+    return hashlib.sha256(row_identity.encode("utf-8")).hexdigest()
+
+
+def validate_schedule(df: pd.DataFrame, platform_names: list):
+    """Validate and normalize schedule rows column by column.
+
+    Returns the normalized schedule, a mask per platform of the rows that
+    platform can publish, the errors of rows no platform can publish, and the
+    rows skipped on a platform that does not support their type while another
+    platform publishes them. Platforms without a publisher schedule nothing;
+    their valid rows are all skipped. Row numbers match the uploaded
+    spreadsheet, with the header on row 1.
+    """
+    date_times = pd.to_datetime(df["date_time"], errors="coerce").dt.tz_localize("UTC")
+    post_types = _text_column(df, "type").str.lower()
+    contents = _text_column(df, "content")
+    urls = _text_column(df, "url")
+    post_ids = pd.Series(df.index, index=df.index)
+    if "id" in df.columns:
+        post_ids = pd.to_numeric(df["id"], errors="coerce").fillna(post_ids)
+    row_checks = [
+        (date_times.isna(), "Invalid or missing date_time"),
+        (contents.isna(), "Missing content"),
+        (post_types.isna(), "Missing type"),
+        (
+            post_types.notna() & ~post_types.isin(PostType.values()),
+            f"Unknown type, expected one of {PostType.values()}",
+        ),
+        (post_types.isin(MEDIA_POST_TYPES) & urls.isna(), "Missing url"),
+    ]
+    errors = []
+    valid = pd.Series(True, index=df.index)
+    for failed, message in row_checks:
+        failed = failed.fillna(False).astype(bool)
+        valid &= ~failed
+        errors.extend(
+            {"row": int(index) + 2, "platform": None, "error": message}
+            for index in df.index[failed]
+        )
+    platform_masks = {}
+    unsupported_rows = {}
+    unpublished_platforms = []
+    for platform_name in platform_names:
+        if platform_name not in PUBLISHING_PLATFORMS:
+            unpublished_platforms.append(platform_name)
+            continue
+        supported_types = PLATFORM_POST_TYPES[platform_name]
+        supported = post_types.isin(supported_types).fillna(False).astype(bool)
+        platform_masks[platform_name] = valid & supported
+        unsupported_rows[platform_name] = valid & ~supported
+    scheduled = pd.Series(False, index=df.index)
+    for mask in platform_masks.values():
+        scheduled |= mask
+    skipped = []
+    for platform_name, unsupported in unsupported_rows.items():
+        # A row another platform publishes is skipped here, not rejected.
+        for index in df.index[unsupported]:
+            problem = {
+                "row": int(index) + 2,
+                "platform": platform_name,
+                "error": f"{post_types[index]} posts are not supported",
+            }
+            (skipped if scheduled[index] else errors).append(problem)
+    for platform_name in unpublished_platforms:
+        skipped.extend(
+            {
+                "row": int(index) + 2,
+                "platform": platform_name,
+                "error": f"{platform_name} posts are not published",
+            }
+            for index in df.index[valid]
+        )
+    errors.sort(key=lambda error: error["row"])
+    skipped.sort(key=lambda problem: problem["row"])
+    schedule = pd.DataFrame(
+        {
+            "scheduled_at": date_times,
+            "post_id": post_ids.astype("int64"),
+            "post_type": post_types,
+            "content": contents,
+            "url": urls,
+        }
+    )
+    schedule = schedule.astype(object).where(schedule.notna(), None)
+    return schedule, platform_masks, errors, skipped
+
+
+def build_scheduled_posts(user, schedule: pd.DataFrame, platform_masks: dict):
+    """Build the scheduled posts of every platform from one validated schedule."""
+    publishable = pd.Series(False, index=schedule.index)
+    for mask in platform_masks.values():
+        publishable |= mask
+    schedule = schedule[publishable].sort_values("scheduled_at", kind="stable")
+    platform_rows = {
+        platform_name: mask.loc[schedule.index].to_numpy()
+        for platform_name, mask in platform_masks.items()
+    }
+    scheduled_posts = []
+    for position, row in enumerate(schedule.to_dict("records")):
+        content_hash = get_content_hash(row["post_type"], row["content"], row["url"])
+        for platform_name, rows in platform_rows.items():
+            if not rows[position]:
+                continue
+            scheduled_posts.append(
+                ScheduledPost(
+                    user=user,
+                    platform_name=platform_name,
+                    scheduled_at=row["scheduled_at"].to_pydatetime(),
+                    post_id=row["post_id"],
+                    post_type=row["post_type"],
+                    content=row["content"],
+                    url=row["url"],
+                    content_hash=content_hash,
+                    state=ScheduledPostState.PENDING.value,
+                )
+            )
+    return scheduled_posts
+
+
+def ingest_schedule(user, platform_names: list, df: pd.DataFrame):
+    """Replace the user's pending schedule for the given platforms with the rows of `df`.
+
+    Returns the number of scheduled posts created, the rejected rows and the
+    rows skipped on some of the platforms.
+    """
+    schedule, platform_masks, errors, skipped = validate_schedule(df, platform_names)
+    scheduled_posts = build_scheduled_posts(user, schedule, platform_masks)
+    if not scheduled_posts:
+        return 0, errors, skipped
+    with transaction.atomic():
+        # Posts waiting out a retry were already claimed and are kept.
+        replaced_posts = ScheduledPost.objects.filter(
+            user=user,
+            platform_name__in=platform_names,
+            state=ScheduledPostState.PENDING.value,
+            next_attempt_at__isnull=True,
+        )
+        prefetched_media = list(
+            replaced_posts.filter(media_prefetched_at__isnull=False).values_list(
+                "url", "media_prefetch_host"
+            )
+        )
+        replaced_posts.delete()
+        ScheduledPost.objects.bulk_create(scheduled_posts, batch_size=500)
+    for url, host in prefetched_media:
+        media_store.release(url, host=host)
+    return len(scheduled_posts), errors, skipped
+
+
+def claim_scheduled_post(scheduled_post: ScheduledPost):
+    """Atomically claim a pending post for publishing.
+
+    A claim is recorded once per (user, platform, content, scheduled time), so a
+    post is published only once even when posting windows overlap or the same
+    schedule is uploaded again. Returns False if the post was already claimed.
+    A post put back to pending by `reschedule_post` keeps its original claim.
+    """
+    dispatched_at = timezone.now()
+    try:
+        with transaction.atomic():
+            updated = ScheduledPost.objects.filter(
+                pk=scheduled_post.pk, state=ScheduledPostState.PENDING.value
+            ).update(
+                state=ScheduledPostState.DISPATCHED.value, dispatched_at=dispatched_at
+            )
+            if not updated:
+                return False
+            if not scheduled_post.next_attempt_at:
+                PostClaim.objects.create(
+                    user_id=scheduled_post.user_id,
+                    platform_name=scheduled_post.platform_name,
+                    content_hash=scheduled_post.content_hash
+                    or get_content_hash(
+                        scheduled_post.post_type,
+                        scheduled_post.content,
+                        scheduled_post.url,
+                    ),
+                    scheduled_at=scheduled_post.scheduled_at,
+                    scheduled_post=scheduled_post,
+                )
+    except IntegrityError:
+        cancelled = ScheduledPost.objects.filter(
+            pk=scheduled_post.pk, state=ScheduledPostState.PENDING.value
+        ).update(state=ScheduledPostState.CANCELLED.value)
+        if cancelled:
+            release_prefetched_media(scheduled_post)
+        return False
+    scheduled_post.state = ScheduledPostState.DISPATCHED.value
+    scheduled_post.dispatched_at = dispatched_at
+    return True
+
+
+def release_claim(scheduled_post: ScheduledPost):
+    """Undo the claim of a post that was never handed to a publisher.
+
+    The claim and the post's unpublished PostedContent are dropped and the post
+    goes back to PENDING, so the next posting cycle claims it again. A post
+    waiting for its next attempt keeps both.
+    """
+    with transaction.atomic():
+        if not scheduled_post.next_attempt_at:
+            PostClaim.objects.filter(scheduled_post=scheduled_post).delete()
+            PostedContent.objects.filter(
+                scheduled_post=scheduled_post, is_posted=False
+            ).delete()
+        ScheduledPost.objects.filter(
+            pk=scheduled_post.pk, state=ScheduledPostState.DISPATCHED.value
+        ).update(state=ScheduledPostState.PENDING.value)
+    scheduled_post.state = ScheduledPostState.PENDING.value
+
+
+def reschedule_post(scheduled_post: ScheduledPost):
+    """Put a post back to PENDING, to be claimed again at its `next_attempt_at`.
+
+    Used for waits too long to hold in a delayed message. The post keeps its
+    scheduled time, its claim, its attempts and its PostedContent.
+    """
+    ScheduledPost.objects.filter(
+        pk=scheduled_post.pk, state=ScheduledPostState.DISPATCHED.value
+    ).update(state=ScheduledPostState.PENDING.value)
+    scheduled_post.state = ScheduledPostState.PENDING.value
+
+
+def release_prefetched_media(scheduled_post: ScheduledPost):
+    """Give back the media store lease a prefetch took for the post, if any.
+
+    The database is checked rather than the instance, which may predate the
+    prefetch. The lease is given back on the host that took it.
+    """
+    if not scheduled_post.url:
+        return
+    prefetches = ScheduledPost.objects.filter(
+        pk=scheduled_post.pk, media_prefetched_at__isnull=False
+    )
+    host = prefetches.values_list("media_prefetch_host", flat=True).first()
+    released = prefetches.update(media_prefetched_at=None, media_prefetch_host=None)
+    scheduled_post.media_prefetched_at = None
+    scheduled_post.media_prefetch_host = None
+    if released:
+        media_store.release(scheduled_post.url, host=host)
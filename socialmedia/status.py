@@ -0,0 +1,121 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+import digitalplatform.settings as settings
+from .models import PostedContent, PostStatusEvent
+from .enums import PostStatus
+
+logger = logging.getLogger(__name__)
+
+
+class StatusWriter:
+    """Write-behind buffer for PostedContent status transitions.
+
+    Transitions update the in-memory object right away and are written in
+    batches: the rows touched since the last flush get one bulk UPDATE of the
+    status fields, and every transition is appended to the status event log.
+    """
+
+    def __init__(self, max_batch: int, flush_interval: float):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._events = []
+        self._flusher = None
+        self._flusher_pid = None
+
+    def record(
+        self,
+        posted_content: PostedContent,
+        status: PostStatus,
+        error_reason=None,
+        failure=None,
+    ):
+        posted_content.post_status = status.value
+        # Kept on the instance only, for the retry decision after the publisher.
+        posted_content.last_failure = failure
+        if status == PostStatus.POSTED:
+            posted_content.is_posted = True
+        if error_reason is not None:
+            posted_content.error_reason = str(error_reason)[:1000]
+        with self._lock:
+            self._pending[posted_content.pk] = posted_content
+            self._events.append(
+                PostStatusEvent(
+                    posted_content_id=posted_content.pk,
+                    post_status=posted_content.post_status,
+                    error_reason=posted_content.error_reason,
+                    created_on=timezone.now(),
+                )
+            )
+            should_flush = len(self._events) >= self.max_batch
+        self._start_flusher()
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending.values())
+                events = self._events
+                self._pending = {}
+                self._events = []
+            if not events:
+                return
+            try:
+                with transaction.atomic():
+                    PostedContent.objects.bulk_update(
+                        pending, ["post_status", "error_reason", "is_posted"]
+                    )
+                    PostStatusEvent.objects.bulk_create(events)
+            except Exception:
+                with self._lock:
+                    for posted_content in pending:
+                        self._pending.setdefault(posted_content.pk, posted_content)
+                    self._events = events + self._events
+                raise
+
+    def _start_flusher(self):
+        # Started lazily so every forked Celery worker process gets its own thread.
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="status-writer", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing post statuses")
+            finally:
+                close_old_connections()
+
+
+status_writer = StatusWriter(
+    max_batch=settings.STATUS_WRITER_MAX_BATCH,
+    flush_interval=settings.STATUS_WRITER_FLUSH_INTERVAL,
+)
+atexit.register(status_writer.flush)
+
+
+def set_post_status(
+    posted_content: PostedContent, status: PostStatus, error_reason=None, failure=None
+):
+    """Record a status transition; `failure` is the response or error behind an ERROR."""
+    status_writer.record(posted_content, status, error_reason, failure)
+
+
+def flush_post_statuses():
+    status_writer.flush()
@@ -1,13 +1,36 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from .models import Linkedin, PostedContent, X, TikTok, UserUploadedFiles
+from .models import Linkedin, PostedContent, X, TikTok, ScheduledPost
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from . import linkedin as LIN, tiktok as TT, x as XT
-from threading import Thread
-import pandas as pd
+from itertools import groupby
 import pytz
-from .enums import PostStatus, PostType, Platforms
+import digitalplatform.settings as settings
+from .enums import (
+    EndpointFamily,
+    PostStatus,
+    PostType,
+    Platforms,
+    ScheduledPostState,
+)
+from .schedules import (
+    PUBLISHING_PLATFORMS,
+    claim_scheduled_post,
+    release_claim,
+    release_prefetched_media,
+    reschedule_post,
+)
+from .publishers import PublisherQueueFull, get_publisher_pool
+from .status import flush_post_statuses, set_post_status
+from .retries import is_transient_failure, schedule_retry
+from .breakers import get_circuit_breaker
+from .media import media_store, validate_media
+from .uploads import close_upload_session
 
 logger = get_task_logger(__name__)
 
@@ -60,274 +83,658 @@ def refresh_tiktok_tokens():
             )
 
 
+def _get_publisher(scheduled_post: ScheduledPost, account):
+    """Return the publisher function and its kwargs for a scheduled post.
+
+    `None` means the platform cannot publish this post.
+    """
+    username = scheduled_post.user.username
+    platform_name = scheduled_post.platform_name
+    post_type = scheduled_post.post_type
+    post_content = scheduled_post.content
+    post_url = scheduled_post.url
+    if platform_name == Platforms.LINKEDIN.value:
+        if post_type == PostType.TEXT.value:
+            return LIN.create_linkedin_content_post, {
+                "user_linkedin": account,
+                "post_content": post_content,
+            }
+        if post_type == PostType.IMAGE.value:
+            if not post_url:
+                logger.warning(
+                    f"Missing image URL in LinkedIn schedule for user {username}."
+                )
+                return None
+            return LIN.create_linkedin_image_post, {
+                "user_linkedin": account,
+                "post_content": post_content,
+                "url": post_url,
+            }
+        logger.info(
+            f"LinkedIn does not support {post_type} posts For now. Skipping for user {username}."
+        )
+        return None
+    if platform_name == Platforms.TIKTOK.value:
+        if not post_url:
+            logger.warning(f"Missing video URL in TikTok schedule for user {username}.")
+            return None
+        if post_type != PostType.VIDEO.value:
+            logger.info(
+                f"TikTok only supports video posts for Now. Skipping for user {username}."
+            )
+            return None
+        return TT.post_video_on_tiktok, {
+            "user_tiktok": account,
+            "video_url": post_url,
+            "content": post_content,
+        }
+    if platform_name == Platforms.X.value:
+        if post_type == PostType.TEXT.value:
+            return XT.create_x_content_tweet, {"content": post_content, "x": account}
+        if post_type in [PostType.IMAGE.value, PostType.VIDEO.value]:
+            if not post_url:
+                logger.warning(
+                    f"Missing {post_type} URL in X schedule for user {username}."
+                )
+                return None
+            return XT.create_x_image_or_video_tweet, {
+                "content": post_content,
+                "url": post_url,
+                "x": account,
+            }
+        return None
+    return None
+
+
+ACCOUNT_MODELS = {
+    Platforms.LINKEDIN.value: Linkedin,
+    Platforms.TIKTOK.value: TikTok,
+    Platforms.X.value: X,
+}
+
+# The "window" schedule mode claims the posts scheduled 3 to 4 hours ahead.
+POSTING_WINDOW_LEAD = timedelta(hours=3)
+
+
+def get_authenticated_accounts(user_ids):
+    """Load the authenticated accounts of many users with one query per platform.
+
+    Returns a dict of platform name to a dict of user id to account.
+    """
+    accounts_by_platform = {}
+    for platform_name, account_model in ACCOUNT_MODELS.items():
+        accounts_by_user = {}
+        accounts = account_model.objects.filter(
+            user_id__in=user_ids, is_authenticated=True
+        ).order_by("-pk")
+        for account in accounts:
+            accounts_by_user[account.user_id] = account
+        accounts_by_platform[platform_name] = accounts_by_user
+    return accounts_by_platform
+
+
+def _get_dispatched_attempt(scheduled_post: ScheduledPost):
+    """Select the post while it still waits for the attempt this dispatch carries.
+
+    Updates through it only apply while the post carries this dispatch's
+    `dispatched_at` and the attempt has not been started or deferred, so a post
+    handed out twice is handled once.
+    """
+    posts = ScheduledPost.objects.filter(
+        pk=scheduled_post.pk, dispatched_at=scheduled_post.dispatched_at
+    )
+    if scheduled_post.next_attempt_at:
+        return posts.filter(next_attempt_at=scheduled_post.next_attempt_at)
+    if not scheduled_post.publish_started_at:
+        return posts.filter(
+            publish_started_at__isnull=True, next_attempt_at__isnull=True
+        )
+    return posts
+
+
+def _record_publish_start(scheduled_post: ScheduledPost):
+    """Record that this dispatch of the post starts publishing it.
+
+    Returns False for the losing dispatch of a post handed out twice.
+    """
+    publish_started_at = scheduled_post.publish_started_at or timezone.now()
+    if not _get_dispatched_attempt(scheduled_post).update(
+        next_attempt_at=None, publish_started_at=publish_started_at
+    ):
+        return False
+    if scheduled_post.publish_started_at:
+        logger.info(
+            f"Retrying {scheduled_post.platform_name} post {scheduled_post.pk}, attempt {scheduled_post.attempts + 1}."
+        )
+    else:
+        lateness = (publish_started_at - scheduled_post.scheduled_at).total_seconds()
+        logger.info(
+            f"Publishing {scheduled_post.platform_name} post {scheduled_post.pk} {lateness:.1f}s after its scheduled time."
+        )
+    scheduled_post.next_attempt_at = None
+    scheduled_post.publish_started_at = publish_started_at
+    return True
+
+
+def _get_publish_args(scheduled_post: ScheduledPost):
+    dispatched_at = scheduled_post.dispatched_at
+    return [scheduled_post.pk, dispatched_at.isoformat() if dispatched_at else None]
+
+
+def _dispatch_post(scheduled_post: ScheduledPost, delay: float = 0):
+    """Hand a claimed post to the active dispatcher, to be published in `delay` seconds.
+
+    Delays over PUBLISH_RETRY_MAX_DELAY are not held by the broker or the
+    pool: the post goes back to pending and a later posting cycle claims it.
+    """
+    if delay > settings.PUBLISH_RETRY_MAX_DELAY:
+        reschedule_post(scheduled_post)
+        logger.info(
+            f"{scheduled_post.platform_name} post {scheduled_post.pk} goes back to pending until {scheduled_post.next_attempt_at}."
+        )
+        return
+    if settings.POSTING_DISPATCH_MODE == "threads":
+        if delay > 0:
+            # Never blocks, so a publisher thread can reschedule its own post.
+            get_publisher_pool().schedule(
+                scheduled_post.platform_name,
+                delay,
+                publish_scheduled_post,
+                scheduled_post.pk,
+                scheduled_post.dispatched_at,
+            )
+            return
+        get_publisher_pool().submit(
+            scheduled_post.platform_name,
+            publish_scheduled_post,
+            scheduled_post.pk,
+            scheduled_post.dispatched_at,
+            timeout=settings.PUBLISHER_SUBMIT_TIMEOUT,
+        )
+        return
+    publish_post.apply_async(
+        args=_get_publish_args(scheduled_post),
+        queue=scheduled_post.platform_name,
+        countdown=delay or None,
+    )
+
+
+def _retry_if_transient(scheduled_post: ScheduledPost, posted_content: PostedContent):
+    if posted_content.post_status != PostStatus.ERROR.value:
+        return
+    failure = getattr(posted_content, "last_failure", None)
+    if not is_transient_failure(failure):
+        return
+    delay = schedule_retry(scheduled_post, failure)
+    if delay is None:
+        logger.warning(
+            f"Giving up on {scheduled_post.platform_name} post {scheduled_post.pk} after {scheduled_post.attempts + 1} attempts."
+        )
+        return
+    set_post_status(posted_content, PostStatus.RETRYING)
+    _dispatch_post(scheduled_post, delay)
+    logger.info(
+        f"Retrying {scheduled_post.platform_name} post {scheduled_post.pk} in {delay:.0f}s: {posted_content.error_reason}"
+    )
+
+
+def _defer_if_circuit_open(scheduled_post: ScheduledPost, posted_content):
+    families = [EndpointFamily.PUBLISH.value]
+    if scheduled_post.post_type in [PostType.IMAGE.value, PostType.VIDEO.value]:
+        families.append(EndpointFamily.MEDIA.value)
+    breaker = get_circuit_breaker()
+    delay = max(
+        breaker.get_blocked_seconds(scheduled_post.platform_name, family)
+        for family in families
+    )
+    if not delay:
+        return False
+    # Deferring does not start the attempt, so publish_started_at is left as is.
+    next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    if not _get_dispatched_attempt(scheduled_post).update(
+        next_attempt_at=next_attempt_at
+    ):
+        logger.info(
+            f"{scheduled_post.platform_name} post {scheduled_post.pk} was already started by another dispatch."
+        )
+        return True
+    scheduled_post.next_attempt_at = next_attempt_at
+    set_post_status(
+        posted_content,
+        PostStatus.RETRYING,
+        f"{scheduled_post.platform_name} circuit is open, deferred for {delay:.0f}s",
+    )
+    _dispatch_post(scheduled_post, delay)
+    logger.info(
+        f"Deferred {scheduled_post.platform_name} post {scheduled_post.pk} for {delay:.0f}s while its circuit is open."
+    )
+    return True
+
+
+def _run_publisher(scheduled_post: ScheduledPost, target, kwargs):
+    posted_content = kwargs["posted_content"]
+    # Check before the attempt starts, and before the publisher downloads media
+    # for a platform that is down.
+    if _defer_if_circuit_open(scheduled_post, posted_content):
+        flush_post_statuses()
+        return
+    if not _record_publish_start(scheduled_post):
+        logger.info(
+            f"{scheduled_post.platform_name} post {scheduled_post.pk} was already started by another dispatch."
+        )
+        return
+    try:
+        return target(**kwargs)
+    except Exception as e:
+        set_post_status(posted_content, PostStatus.ERROR, str(e), failure=e)
+        raise
+    finally:
+        try:
+            release_prefetched_media(scheduled_post)
+            _retry_if_transient(scheduled_post, posted_content)
+            _close_abandoned_upload(scheduled_post, posted_content)
+        finally:
+            flush_post_statuses()
+
+
+def _close_abandoned_upload(scheduled_post: ScheduledPost, posted_content):
+    # Only a post that will be retried keeps its upload session.
+    if scheduled_post.post_type != PostType.VIDEO.value:
+        return
+    if posted_content.post_status != PostStatus.RETRYING.value:
+        close_upload_session(posted_content)
+
+
+def _prefetch_media(scheduled_post: ScheduledPost):
+    try:
+        path = media_store.acquire(scheduled_post.url)
+        error = validate_media(path, scheduled_post.post_type)
+        if error:
+            logger.warning(
+                f"Prefetched media of {scheduled_post.platform_name} post {scheduled_post.pk} looks invalid: {error}"
+            )
+        # The lease is kept until the post is published or cancelled; a post
+        # claimed or cancelled meanwhile does not take it.
+        prefetched = ScheduledPost.objects.filter(
+            pk=scheduled_post.pk,
+            state=ScheduledPostState.PENDING.value,
+            media_prefetched_at__isnull=True,
+        ).update(
+            media_prefetched_at=timezone.now(), media_prefetch_host=media_store.host
+        )
+        if not prefetched:
+            media_store.release(scheduled_post.url)
+        return bool(prefetched)
+    except Exception as e:
+        logger.warning(
+            f"Failed to prefetch media of {scheduled_post.platform_name} post {scheduled_post.pk}: {str(e)}"
+        )
+        return False
+    finally:
+        close_old_connections()
+
+
+@shared_task
+def prefetch_scheduled_media():
+    time_rnow = timezone.now()
+    upcoming_posts = list(
+        ScheduledPost.objects.filter(
+            state=ScheduledPostState.PENDING.value,
+            platform_name__in=PUBLISHING_PLATFORMS,
+            post_type__in=[PostType.IMAGE.value, PostType.VIDEO.value],
+            url__isnull=False,
+            media_prefetched_at__isnull=True,
+            scheduled_at__gte=time_rnow - settings.POSTING_LATE_GRACE,
+            scheduled_at__lte=time_rnow + settings.MEDIA_PREFETCH_HORIZON,
+        ).order_by("scheduled_at")
+    )
+    if not upcoming_posts:
+        logger.info("No upcoming media posts to prefetch.")
+        return
+    with ThreadPoolExecutor(
+        max_workers=settings.MEDIA_PREFETCH_CONCURRENCY,
+        thread_name_prefix="media-prefetch",
+    ) as executor:
+        prefetched = sum(executor.map(_prefetch_media, upcoming_posts))
+    logger.info(
+        f"Prefetched media for {prefetched} of {len(upcoming_posts)} upcoming posts. Media store: {media_store.stats()}"
+    )
+
+
+def claim_due_posts(start_window, end_window, on_commit=None, resume_until=None):
+    """Claim the pending posts scheduled inside the window.
+
+    Posts put back to pending to wait for their next attempt are claimed once
+    that attempt is due by `resume_until`, which defaults to `end_window`.
+    Returns a list of (scheduled_post, (publisher, kwargs), posted_content) for
+    every post claimed by this call. `on_commit` is called with that list once
+    the claims are committed.
+    """
+    due_posts = (
+        ScheduledPost.objects.filter(
+            state=ScheduledPostState.PENDING.value,
+            platform_name__in=PUBLISHING_PLATFORMS,
+        )
+        .filter(
+            Q(
+                next_attempt_at__isnull=True,
+                scheduled_at__gte=start_window,
+                scheduled_at__lte=end_window,
+            )
+            | Q(next_attempt_at__lte=resume_until or end_window)
+        )
+        .select_related("user")
+        .order_by("user_id", "scheduled_at")
+    )
+    if not due_posts:
+        logger.info("No scheduled posts found for posting.")
+        return []
+    due_posts = list(due_posts)
+    accounts_by_platform = get_authenticated_accounts(
+        {scheduled_post.user_id for scheduled_post in due_posts}
+    )
+    cancelled_posts = []
+    resumed_posts = {}
+    claimed_posts = []
+    # Claims and PostedContent rows for the whole cycle are written in one
+    # transaction; publishers are only handed IDs once it has committed. A
+    # crash in between leaves the posts to redispatch_stranded_posts.
+    with transaction.atomic():
+        for user_id, user_posts in groupby(due_posts, key=lambda post: post.user_id):
+            user_posts = list(user_posts)
+            user = user_posts[0].user
+            accounts = {
+                platform_name: accounts_by_user.get(user_id)
+                for platform_name, accounts_by_user in accounts_by_platform.items()
+            }
+            if not any(accounts.values()):
+                logger.info(
+                    f"No authenticated social media accounts found for user {user.username}."
+                )
+                continue
+            for scheduled_post in user_posts:
+                account = accounts.get(scheduled_post.platform_name)
+                if not account:
+                    continue
+                publisher = None
+                if scheduled_post.content and scheduled_post.post_type:
+                    publisher = _get_publisher(scheduled_post, account)
+                else:
+                    logger.warning(
+                        f"Missing required fields in {scheduled_post.platform_name} schedule for user {user.username}."
+                    )
+                if not publisher:
+                    cancelled_posts.append(scheduled_post)
+                    continue
+                if not claim_scheduled_post(scheduled_post):
+                    logger.info(
+                        f"{scheduled_post.platform_name} post {scheduled_post.pk} for user {user.username} was already claimed."
+                    )
+                    continue
+                if scheduled_post.next_attempt_at:
+                    # Back from a long retry wait; it keeps its PostedContent.
+                    resumed_posts[scheduled_post.pk] = len(claimed_posts)
+                    claimed_posts.append((scheduled_post, publisher, None))
+                    continue
+                posted_content = PostedContent(
+                    user=user,
+                    post_type=scheduled_post.post_type,
+                    post_status=PostStatus.STARTED.value,
+                    platform_name=scheduled_post.platform_name,
+                    post_id=scheduled_post.post_id,
+                    is_posted=False,
+                    error_reason=None,
+                    scheduled_post=scheduled_post,
+                )
+                claimed_posts.append((scheduled_post, publisher, posted_content))
+        if cancelled_posts:
+            ScheduledPost.objects.filter(
+                pk__in=[scheduled_post.pk for scheduled_post in cancelled_posts]
+            ).update(state=ScheduledPostState.CANCELLED.value)
+            for scheduled_post in cancelled_posts:
+                release_prefetched_media(scheduled_post)
+        PostedContent.objects.bulk_create(
+            [posted_content for _, _, posted_content in claimed_posts if posted_content]
+        )
+        if resumed_posts:
+            for posted_content in PostedContent.objects.filter(
+                scheduled_post_id__in=resumed_posts
+            ).order_by("pk"):
+                index = resumed_posts[posted_content.scheduled_post_id]
+                scheduled_post, publisher, _ = claimed_posts[index]
+                claimed_posts[index] = (scheduled_post, publisher, posted_content)
+        if on_commit and claimed_posts:
+            transaction.on_commit(partial(on_commit, claimed_posts))
+    return claimed_posts
+
+
 @shared_task
 def start_social_media_posting():
     time_rnow = timezone.now()
-    start_window = time_rnow + timedelta(hours=3)
-    end_window = start_window + timedelta(hours=1)
+    use_eta = settings.POSTING_SCHEDULE_MODE == "eta"
+    if use_eta:
+        start_window = time_rnow - settings.POSTING_LATE_GRACE
+        end_window = time_rnow + settings.POSTING_ETA_HORIZON
+        resume_until = end_window
+    else:
+        start_window = time_rnow + POSTING_WINDOW_LEAD
+        end_window = start_window + timedelta(hours=1)
+        # Retries are not published ahead of time like the window's posts.
+        resume_until = time_rnow
     start_window = start_window.astimezone(pytz.UTC)
     end_window = end_window.astimezone(pytz.UTC)
     logger.info(
         f"Starting social media posting task. Current time: {time_rnow}, Start window: {start_window}, End window: {end_window}"
     )
-    users_files = UserUploadedFiles.objects.all()
-    if not users_files:
-        logger.info("No user files found for posting.")
-        return
-    for user_file in users_files:
-        has_linkedin = False
-        has_tiktok = False
-        has_x = False
-        user = user_file.user
-        linkedin_file_path = user_file.linkedin_file_path
-        tiktok_file_path = user_file.tiktok_file_path
-        x_file_path = user_file.x_file_path
-        instagram_file_path = user_file.instagram_file_path
-        if (
-            linkedin_file_path == tiktok_file_path == x_file_path == instagram_file_path
-            and not linkedin_file_path
-        ):
-            logger.info(f"No files uploaded for user {user.username}.")
+    claim_due_posts(
+        start_window,
+        end_window,
+        on_commit=partial(
+            _dispatch_claimed_posts, dispatch_time=time_rnow, use_eta=use_eta
+        ),
+        resume_until=resume_until,
+    )
+
+
+def _get_due_time(scheduled_post: ScheduledPost):
+    # A post back from a long retry wait is due at its next attempt.
+    return scheduled_post.next_attempt_at or scheduled_post.scheduled_at
+
+
+def _dispatch_claimed_posts(claimed_posts, dispatch_time, use_eta):
+    full_platforms = set()
+    for scheduled_post, (target, kwargs), posted_content in claimed_posts:
+        username = scheduled_post.user.username
+        if scheduled_post.platform_name in full_platforms:
+            release_claim(scheduled_post)
             continue
-        linkedin = Linkedin.objects.filter(user=user, is_authenticated=True).first()
-        if linkedin:
-            has_linkedin = True
-        tiktok = TikTok.objects.filter(user=user, is_authenticated=True).first()
-        if tiktok:
-            has_tiktok = True
-        x = X.objects.filter(user=user, is_authenticated=True).first()
-        if x:
-            has_x = True
-        if not has_linkedin and not has_tiktok and not has_x:
+        try:
             logger.info(
-                f"No authenticated social media accounts found for user {user.username}."
+                f"Scheduled {scheduled_post.platform_name} {scheduled_post.post_type} post for user {username}."
             )
-            continue
-        if linkedin_file_path and has_linkedin:
-            try:
-                df = pd.read_csv(linkedin_file_path, quotechar='"')
-                df["date_time"] = pd.to_datetime(df["date_time"]).dt.tz_localize("UTC")
-                future_posts = df[
-                    (df["date_time"] >= start_window) & (df["date_time"] <= end_window)
-                ]
-                print(future_posts)
-                if future_posts.empty:
-                    logger.info(
-                        f"No future posts found in LinkedIn file for user {user.username}."
-                    )
-                for _, row in future_posts.iterrows():
-                    post_id = row.get("id", "")
-                    post_content = row.get("content", "")
-                    post_type = row.get("type", "")
-                    post_url = row.get("url", "")
-                    posting_datetime = row.get("date_time", "")
-                    print(posting_datetime)
-                    if not post_content or not post_type or not posting_datetime:
-                        logger.warning(
-                            f"Missing required fields in LinkedIn file for user {user.username}."
-                        )
-                        continue
-                    if post_type == PostType.TEXT.value:
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.TEXT.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.LINKEDIN.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(
-                            f"Scheduled LinkedIn text post for user {user.username}."
-                        )
-                        Thread(
-                            target=LIN.create_linkedin_content_post,
-                            args=(linkedin, post_content, posted_content),
-                        ).start()
-                    elif post_type == PostType.IMAGE.value:
-                        if not post_url:
-                            logger.warning(
-                                f"Missing image URL in LinkedIn file for user {user.username}."
-                            )
-                            continue
-                        if not post_id:
-                            logger.warning(
-                                f"Missing post ID in LinkedIn file for user {user.username}."
-                            )
-                            post_id = _
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.IMAGE.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.LINKEDIN.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(
-                            f"Scheduled LinkedIn image post for user {user.username}."
-                        )
-                        Thread(
-                            target=LIN.create_linkedin_image_post,
-                            args=(linkedin, post_content, posted_content, post_url),
-                        ).start()
-                    elif post_type == PostType.VIDEO.value:
-                        logger.info(
-                            f"LinkedIn does not support video posts For now. Skipping for user {user.username}."
-                        )
-                        continue
-            except Exception as e:
-                logger.error(
-                    f"Error processing LinkedIn file for user {user.username}: {str(e)}"
+            if settings.POSTING_DISPATCH_MODE != "threads":
+                publish_post.apply_async(
+                    args=_get_publish_args(scheduled_post),
+                    queue=scheduled_post.platform_name,
+                    eta=(
+                        max(_get_due_time(scheduled_post), dispatch_time)
+                        if use_eta
+                        else None
+                    ),
                 )
-        if tiktok_file_path and has_tiktok:
+                continue
+            kwargs["posted_content"] = posted_content
+            delay = 0
+            if use_eta:
+                delay = (_get_due_time(scheduled_post) - timezone.now()).total_seconds()
             try:
-                df = pd.read_csv(tiktok_file_path, quotechar='"')
-                df["date_time"] = pd.to_datetime(df["date_time"]).dt.tz_localize("UTC")
-                future_posts = df[
-                    (df["date_time"] >= start_window) & (df["date_time"] <= end_window)
-                ]
-                print(future_posts)
-                if future_posts.empty:
-                    logger.info(
-                        f"No future posts found in Tiktok file for user {user.username}."
+                if delay > 0:
+                    # The pool's timer thread holds the post until it is due.
+                    get_publisher_pool().schedule(
+                        scheduled_post.platform_name,
+                        delay,
+                        _run_publisher,
+                        scheduled_post,
+                        target,
+                        kwargs,
                     )
-                for _, row in future_posts.iterrows():
-                    post_id = row.get("id", "")
-                    post_content = row.get("content", "")
-                    post_type = row.get("type", "")
-                    post_url = row.get("url", "")
-                    posting_datetime = row.get("date_time", "")
-                    if not post_content or not post_type or not posting_datetime:
-                        logger.warning(
-                            f"Missing required fields in TikTok file for user {user.username}."
-                        )
-                        continue
-                    if not post_url:
-                        logger.warning(
-                            f"Missing video URL in TikTok file for user {user.username}."
-                        )
-                        continue
-                    if not post_id:
-                        logger.warning(
-                            f"Missing post ID in TikTok file for user {user.username}."
-                        )
-                        post_id = _
-                    if post_type == PostType.VIDEO.value:
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.VIDEO.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.TIKTOK.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(
-                            f"Scheduled TikTok video post for user {user.username}."
-                        )
-                        Thread(
-                            target=TT.post_video_on_tiktok,
-                            args=(tiktok, post_url, posted_content, post_content),
-                        ).start()
-                    else:
-                        logger.info(
-                            f"TikTok only supports video posts for Now. Skipping for user {user.username}."
-                        )
-                        continue
-            except Exception as e:
-                logger.error(
-                    f"Error processing TikTok file for user {user.username}: {str(e)}"
+                    continue
+                get_publisher_pool().submit(
+                    scheduled_post.platform_name,
+                    _run_publisher,
+                    scheduled_post,
+                    target,
+                    kwargs,
+                    timeout=settings.PUBLISHER_SUBMIT_TIMEOUT,
                 )
-        if x_file_path and has_x:
-            try:
-                df = pd.read_csv(x_file_path, quotechar='"')
-                df["date_time"] = pd.to_datetime(df["date_time"]).dt.tz_localize("UTC")
-                future_posts = df[
-                    (df["date_time"] >= start_window) & (df["date_time"] <= end_window)
-                ]
-                print(future_posts)
-                if future_posts.empty:
-                    logger.info(
-                        f"No future posts found in Twitter file for user {user.username}."
-                    )
-                for _, row in future_posts.iterrows():
-                    post_id = row.get("id", "")
-                    post_content = row.get("content", "")
-                    post_type = row.get("type", "")
-                    post_url = row.get("url", "")
-                    posting_datetime = row.get("date_time", "")
-                    if not post_content or not post_type or not posting_datetime:
-                        logger.warning(
-                            f"Missing required fields in LinkedIn file for user {user.username}."
-                        )
-                        continue
-                    if post_type == PostType.TEXT.value:
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.TEXT.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.X.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(f"Scheduled X text post for user {user.username}.")
-                        Thread(
-                            target=XT.create_x_content_tweet,
-                            args=(post_content, x, posted_content),
-                        ).start()
-                    elif post_type == PostType.IMAGE.value:
-                        if not post_url:
-                            logger.warning(
-                                f"Missing image URL in X file for user {user.username}."
-                            )
-                            continue
-                        if not post_id:
-                            logger.warning(
-                                f"Missing post ID in X file for user {user.username}."
-                            )
-                            post_id = _
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.IMAGE.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.X.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(f"Scheduled X image post for user {user.username}.")
-                        Thread(
-                            target=XT.create_x_image_or_video_tweet,
-                            args=(post_content, post_url, x, posted_content),
-                        ).start()
-                    elif post_type == PostType.VIDEO.value:
-                        if not post_url:
-                            logger.warning(
-                                f"Missing video URL in X file for user {user.username}."
-                            )
-                            continue
-                        if not post_id:
-                            logger.warning(
-                                f"Missing post ID in X file for user {user.username}."
-                            )
-                            post_id = _
-                        posted_content = PostedContent.objects.create(
-                            user=user,
-                            post_type=PostType.VIDEO.value,
-                            post_status=PostStatus.STARTED.value,
-                            platform_name=Platforms.X.value,
-                            post_id=post_id,
-                            is_posted=False,
-                            error_reason=None,
-                        )
-                        logger.info(f"Scheduled X video post for user {user.username}.")
-                        Thread(
-                            target=XT.create_x_image_or_video_tweet,
-                            args=(post_content, post_url, x, posted_content),
-                        ).start()
-            except Exception as e:
-                logger.error(
-                    f"Error processing X file for user {user.username}: {str(e)}"
+            except PublisherQueueFull as e:
+                # Leave the post, and the rest of its platform, to the next cycle.
+                full_platforms.add(scheduled_post.platform_name)
+                release_claim(scheduled_post)
+                logger.warning(
+                    f"{e}, {scheduled_post.platform_name} post {scheduled_post.pk} goes back to pending."
                 )
+        except Exception as e:
+            logger.error(
+                f"Error processing {scheduled_post.platform_name} post for user {username}: {str(e)}"
+            )
+    flush_post_statuses()
+    if settings.POSTING_DISPATCH_MODE == "threads":
+        logger.info(f"Publisher pool stats: {get_publisher_pool().stats()}")
+
+
+def publish_scheduled_post(scheduled_post_id, dispatched_at=None):
+    scheduled_post = (
+        ScheduledPost.objects.select_related("user")
+        .filter(pk=scheduled_post_id)
+        .first()
+    )
+    if not scheduled_post:
+        logger.warning(f"Scheduled post {scheduled_post_id} no longer exists.")
+        return
+    if dispatched_at and scheduled_post.dispatched_at != dispatched_at:
+        logger.info(
+            f"Scheduled post {scheduled_post_id} was dispatched again, skipping the earlier dispatch."
+        )
+        return
+    posted_content = (
+        PostedContent.objects.filter(scheduled_post=scheduled_post)
+        .order_by("-pk")
+        .first()
+    )
+    if not posted_content:
+        logger.warning(
+            f"No posted content found for scheduled post {scheduled_post_id}."
+        )
+        return
+    if posted_content.is_posted:
+        logger.info(f"Scheduled post {scheduled_post_id} was already published.")
+        return
+    account_model = ACCOUNT_MODELS.get(scheduled_post.platform_name)
+    account = (
+        account_model.objects.filter(
+            user_id=scheduled_post.user_id, is_authenticated=True
+        ).first()
+        if account_model
+        else None
+    )
+    publisher = _get_publisher(scheduled_post, account) if account else None
+    if not publisher:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"No authenticated {scheduled_post.platform_name} account to publish with",
+        )
+        flush_post_statuses()
+        return
+    target, kwargs = publisher
+    kwargs["posted_content"] = posted_content
+    _run_publisher(scheduled_post, target, kwargs)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def publish_post(scheduled_post_id, dispatched_at=None):
+    if dispatched_at:
+        dispatched_at = datetime.fromisoformat(dispatched_at)
+    publish_scheduled_post(scheduled_post_id, dispatched_at)
+
+
+@shared_task
+def redispatch_stranded_posts():
+    """Dispatch again the claimed posts whose publish task was lost.
+
+    A post is stranded when it was dispatched over POSTING_STRANDED_AFTER ago
+    and has not started although it was due that long ago, or its retry is
+    that long overdue. Each redispatch spends one of the post's attempts.
+    """
+    cutoff = timezone.now() - settings.POSTING_STRANDED_AFTER
+    stranded_posts = ScheduledPost.objects.filter(
+        state=ScheduledPostState.DISPATCHED.value,
+        dispatched_at__lt=cutoff,
+        attempts__lt=settings.PUBLISH_MAX_ATTEMPTS,
+    ).filter(
+        Q(publish_started_at__isnull=True, scheduled_at__lt=cutoff)
+        | Q(next_attempt_at__lt=cutoff)
+    )
+    redispatched = 0
+    for scheduled_post in stranded_posts:
+        # Taking over the dispatch fails if the lost task turned up meanwhile.
+        dispatched_at = timezone.now()
+        if not _get_dispatched_attempt(scheduled_post).update(
+            dispatched_at=dispatched_at, attempts=F("attempts") + 1
+        ):
+            continue
+        scheduled_post.dispatched_at = dispatched_at
+        try:
+            _dispatch_post(scheduled_post)
+            redispatched += 1
+        except Exception as e:
+            logger.error(
+                f"Error redispatching {scheduled_post.platform_name} post {scheduled_post.pk}: {str(e)}"
+            )
+    if redispatched:
+        logger.warning(f"Redispatched {redispatched} stranded posts.")
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def check_x_media_processing(
+    posted_content_id, media_id, content, deadline, x_id=None, failures=0
+):
+    """Tweet an X video post once X has finished processing its media.
+
+    Scheduled by the X publisher instead of polling STATUS in the worker; it
+    reschedules itself every `check_after_secs` until `deadline`. The media
+    belongs to the X account `x_id` that uploaded it.
+    """
+    posted_content = (
+        PostedContent.objects.select_related("scheduled_post")
+        .filter(pk=posted_content_id)
+        .first()
+    )
+    if not posted_content or posted_content.is_posted:
+        return
+    accounts = X.objects.filter(user_id=posted_content.user_id, is_authenticated=True)
+    if x_id:
+        accounts = accounts.filter(pk=x_id)
+    x = accounts.order_by("-pk").first()
+    if not x:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "No authenticated x account to publish with",
+        )
+        flush_post_statuses()
+        return
+    try:
+        XT.continue_x_media_tweet(
+            content, media_id, x, posted_content, deadline, failures
+        )
+    except Exception as e:
+        logger.error(f"Error checking X media {media_id}: {str(e)}")
+        set_post_status(posted_content, PostStatus.ERROR, str(e), failure=e)
+    finally:
+        try:
+            if posted_content.scheduled_post:
+                _retry_if_transient(posted_content.scheduled_post, posted_content)
+        finally:
+            flush_post_statuses()
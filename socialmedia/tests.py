@@ -1,3 +1,1187 @@
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+import pandas as pd
+import requests
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import digitalplatform.settings as settings
+from .breakers import CircuitBreaker, CircuitOpen
+from .clients import ChunkSource, MultipartBody
+from .enums import Platforms, PostStatus, PostType, ScheduledPostState
+from .media import MediaStore
+from .ratelimit import RateLimitExceeded, get_block_seconds
+from .publishers import PublisherPool, PublisherQueueFull
+from .retries import PublishError
+from .schedules import (
+    PUBLISHING_PLATFORMS,
+    claim_scheduled_post,
+    ingest_schedule,
+    validate_schedule,
+)
+from .status import StatusWriter, set_post_status
+from .models import (
+    CachedMedia,
+    Linkedin,
+    PostClaim,
+    PostedContent,
+    PostStatusEvent,
+    ScheduledPost,
+    TikTok,
+    UploadSession,
+    UserUploadedFiles,
+    X,
+)
+from .uploads import ChunkUploader
+from .x import create_x_image_or_video_tweet, upload_media_to_x
+from .tasks import (
+    _prefetch_media,
+    _run_publisher,
+    check_x_media_processing,
+    claim_due_posts,
+    get_authenticated_accounts,
+    publish_post,
+    publish_scheduled_post,
+    redispatch_stranded_posts,
+    start_social_media_posting,
+)
 
-# Create your tests here.
+
+class PostingScanQueryCountTests(TestCase):
+    def create_users_with_due_posts(self, count, authenticated):
+        scheduled_at = timezone.now() - timedelta(minutes=1)
+        users = []
+        for i in range(count):
+            user = User.objects.create(username=f"user{i}")
+            Linkedin.objects.create(user=user, is_authenticated=authenticated)
+            TikTok.objects.create(user=user, is_authenticated=authenticated)
+            X.objects.create(user=user, is_authenticated=authenticated)
+            ScheduledPost.objects.create(
+                user=user,
+                platform_name=Platforms.LINKEDIN.value,
+                scheduled_at=scheduled_at,
+                post_type=PostType.TEXT.value,
+                content="Hello",
+            )
+            users.append(user)
+        return users
+
+    def test_accounts_are_loaded_with_one_query_per_platform(self):
+        users = self.create_users_with_due_posts(10, authenticated=True)
+        with self.assertNumQueries(3):
+            accounts_by_platform = get_authenticated_accounts(
+                {user.pk for user in users}
+            )
+        for accounts_by_user in accounts_by_platform.values():
+            self.assertEqual(set(accounts_by_user), {user.pk for user in users})
+
+    def test_scan_query_count_does_not_grow_with_users(self):
+        self.create_users_with_due_posts(10, authenticated=False)
+        # The due posts, one account query per platform and the cycle's savepoint.
+        with self.assertNumQueries(6):
+            start_social_media_posting()
+
+    def test_posted_content_is_created_in_one_insert(self):
+        self.create_users_with_due_posts(10, authenticated=True)
+        with mock.patch.object(publish_post, "apply_async") as apply_async:
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    start_social_media_posting()
+        inserts = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('INSERT INTO "socialmedia_postedcontent"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(PostedContent.objects.count(), 10)
+        self.assertEqual(apply_async.call_count, 10)
+
+    def test_posts_are_dispatched_once_the_claims_commit(self):
+        self.create_users_with_due_posts(1, authenticated=True)
+        with mock.patch.object(publish_post, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks() as callbacks:
+                start_social_media_posting()
+            apply_async.assert_not_called()
+            for callback in callbacks:
+                callback()
+        self.assertEqual(apply_async.call_count, 1)
+
+
+class PublisherPoolTests(TestCase):
+    def setUp(self):
+        self.pool = PublisherPool(concurrency={Platforms.X.value: 1}, queue_size=0)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_scheduled_jobs_run_in_due_order(self):
+        done = threading.Event()
+        ran = []
+        self.pool.schedule(Platforms.X.value, 0.2, lambda: (ran.append(3), done.set()))
+        self.pool.schedule(Platforms.X.value, 0.1, ran.append, 2)
+        self.pool.submit(Platforms.X.value, ran.append, 1)
+        self.assertEqual(self.pool.stats()[Platforms.X.value]["scheduled"], 2)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(ran, [1, 2, 3])
+
+    def test_due_job_waits_for_a_free_worker(self):
+        release = threading.Event()
+        done = threading.Event()
+        self.pool.submit(Platforms.X.value, release.wait, 5)
+        self.pool.schedule(Platforms.X.value, 0, done.set)
+        self.assertFalse(done.wait(0.2))
+        self.assertEqual(self.pool.stats()[Platforms.X.value]["scheduled"], 1)
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.pool.stats()[Platforms.X.value]["rejected"], 0)
+
+
+class RateLimitHeaderTests(TestCase):
+    def make_response(self, status_code, headers):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        return response
+
+    def test_retry_after_seconds(self):
+        response = self.make_response(429, {"Retry-After": "120"})
+        self.assertEqual(get_block_seconds(response), 120)
+
+    def test_exhausted_x_rate_limit_blocks_until_reset(self):
+        response = self.make_response(
+            200,
+            {
+                "x-rate-limit-remaining": "0",
+                "x-rate-limit-reset": str(int(time.time()) + 60),
+            },
+        )
+        self.assertAlmostEqual(get_block_seconds(response), 60, delta=2)
+
+    def test_successful_response_does_not_block(self):
+        response = self.make_response(200, {"x-rate-limit-remaining": "10"})
+        self.assertEqual(get_block_seconds(response), 0)
+
+
+class PublishRetryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="retry")
+        self.scheduled_post = ScheduledPost.objects.create(
+            user=user,
+            platform_name=Platforms.X.value,
+            scheduled_at=timezone.now(),
+            post_type=PostType.TEXT.value,
+            content="Hello",
+        )
+        self.posted_content = PostedContent.objects.create(
+            user=user,
+            platform_name=Platforms.X.value,
+            scheduled_post=self.scheduled_post,
+        )
+
+    def fail_with(self, status_code):
+        response = requests.Response()
+        response.status_code = status_code
+
+        def publisher(posted_content):
+            set_post_status(
+                posted_content, PostStatus.ERROR, "Failed", failure=response
+            )
+
+        with mock.patch.object(publish_post, "apply_async") as apply_async:
+            _run_publisher(
+                self.scheduled_post,
+                publisher,
+                {"posted_content": self.posted_content},
+            )
+        self.scheduled_post.refresh_from_db()
+        self.posted_content.refresh_from_db()
+        return apply_async
+
+    def test_transient_failure_is_rescheduled_with_backoff(self):
+        apply_async = self.fail_with(503)
+        self.assertEqual(self.scheduled_post.attempts, 1)
+        self.assertIsNotNone(self.scheduled_post.next_attempt_at)
+        self.assertEqual(self.posted_content.post_status, PostStatus.RETRYING.value)
+        self.assertGreater(apply_async.call_args.kwargs["countdown"], 0)
+
+    def test_permanent_failure_is_not_retried(self):
+        apply_async = self.fail_with(400)
+        self.assertEqual(self.scheduled_post.attempts, 0)
+        self.assertEqual(self.posted_content.post_status, PostStatus.ERROR.value)
+        apply_async.assert_not_called()
+
+    def test_deferral_does_not_start_the_post(self):
+        publisher = mock.Mock()
+        kwargs = {"posted_content": self.posted_content}
+        original_dispatch = ScheduledPost.objects.get(pk=self.scheduled_post.pk)
+        with mock.patch("socialmedia.tasks.get_circuit_breaker") as breaker:
+            breaker.return_value.get_blocked_seconds.return_value = 30
+            with mock.patch.object(publish_post, "apply_async") as apply_async:
+                _run_publisher(self.scheduled_post, publisher, kwargs)
+            publisher.assert_not_called()
+            self.assertEqual(apply_async.call_args.kwargs["countdown"], 30)
+            deferred_post = ScheduledPost.objects.get(pk=self.scheduled_post.pk)
+            self.assertIsNone(deferred_post.publish_started_at)
+            self.assertIsNotNone(deferred_post.next_attempt_at)
+
+            breaker.return_value.get_blocked_seconds.return_value = 0
+            # The original dispatch turning up again loses to the deferred one.
+            _run_publisher(original_dispatch, publisher, kwargs)
+            publisher.assert_not_called()
+            _run_publisher(deferred_post, publisher, kwargs)
+        publisher.assert_called_once()
+        deferred_post.refresh_from_db()
+        self.assertIsNotNone(deferred_post.publish_started_at)
+        self.assertIsNone(deferred_post.next_attempt_at)
+
+    def test_image_upload_timeout_is_retried(self):
+        image = tempfile.NamedTemporaryFile(suffix=".png")
+        self.addCleanup(image.close)
+        x = X.objects.create(
+            user=self.scheduled_post.user,
+            is_authenticated=True,
+            access_token="a",
+            access_token_secret="b",
+        )
+        with mock.patch("socialmedia.x.media_store") as store, mock.patch(
+            "socialmedia.x.get_session"
+        ) as session, mock.patch.object(publish_post, "apply_async") as apply_async:
+            store.open.return_value.__enter__.return_value = image.name
+            session.return_value.post.side_effect = requests.Timeout("timed out")
+            with self.assertRaises(requests.Timeout):
+                _run_publisher(
+                    self.scheduled_post,
+                    create_x_image_or_video_tweet,
+                    {
+                        "content": "Hello",
+                        "url": "https://example.com/image.png",
+                        "x": x,
+                        "posted_content": self.posted_content,
+                    },
+                )
+        self.scheduled_post.refresh_from_db()
+        self.posted_content.refresh_from_db()
+        self.assertEqual(self.scheduled_post.attempts, 1)
+        self.assertEqual(self.posted_content.post_status, PostStatus.RETRYING.value)
+        self.assertGreater(apply_async.call_args.kwargs["countdown"], 0)
+
+    def test_retry_is_scheduled_on_the_publisher_pool_in_threads_mode(self):
+        with mock.patch.object(
+            settings, "POSTING_DISPATCH_MODE", "threads"
+        ), mock.patch("socialmedia.tasks.get_publisher_pool") as pool:
+            apply_async = self.fail_with(503)
+        apply_async.assert_not_called()
+        platform, delay, fn, *args = pool.return_value.schedule.call_args.args
+        self.assertEqual(platform, Platforms.X.value)
+        self.assertGreater(delay, 0)
+        self.assertEqual(fn, publish_scheduled_post)
+        self.assertEqual(args, [self.scheduled_post.pk, None])
+
+    def test_deferral_is_scheduled_on_the_publisher_pool_in_threads_mode(self):
+        with mock.patch.object(
+            settings, "POSTING_DISPATCH_MODE", "threads"
+        ), mock.patch("socialmedia.tasks.get_circuit_breaker") as breaker, mock.patch(
+            "socialmedia.tasks.get_publisher_pool"
+        ) as pool:
+            breaker.return_value.get_blocked_seconds.return_value = 30
+            apply_async = self.fail_with(503)
+        apply_async.assert_not_called()
+        self.assertEqual(pool.return_value.schedule.call_args.args[1], 30)
+        self.assertEqual(self.scheduled_post.attempts, 0)
+        self.assertEqual(self.posted_content.post_status, PostStatus.RETRYING.value)
+
+
+class MediaStoreTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.store = MediaStore(
+            root=root.name,
+            max_bytes=10,
+            max_age=timedelta(hours=1),
+            lease=timedelta(hours=6),
+        )
+        patcher = mock.patch("socialmedia.media.get_session")
+        self.get = patcher.start().return_value.get
+        self.get.side_effect = lambda url, **kwargs: self.make_response(url)
+        self.addCleanup(patcher.stop)
+
+    def make_response(self, url):
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(url[-6:].encode())
+        return response
+
+    def test_media_is_downloaded_once_and_shared(self):
+        first = self.store.acquire("https://example.com/a.jpg")
+        second = self.store.acquire("https://example.com/a.jpg")
+        self.assertEqual(first, second)
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(CachedMedia.objects.get().refcount, 2)
+
+    def test_only_released_media_is_evicted(self):
+        old = self.store.acquire("https://example.com/a.jpg")
+        self.store.release("https://example.com/a.jpg")
+        held = self.store.acquire("https://example.com/b.jpg")
+        self.store.acquire("https://example.com/c.jpg")
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(held))
+        self.assertEqual(CachedMedia.objects.filter(url__endswith="a.jpg").count(), 0)
+
+    def test_each_host_keeps_its_own_entries(self):
+        other_store = MediaStore(
+            root=self.store.root,
+            max_bytes=10,
+            max_age=timedelta(hours=1),
+            lease=timedelta(hours=6),
+            host="publisher-2",
+        )
+        other_store.acquire("https://example.com/a.jpg")
+        self.store.acquire("https://example.com/a.jpg")
+        self.assertEqual(self.get.call_count, 2)
+        self.store.release("https://example.com/a.jpg", host="publisher-2")
+        self.assertEqual(
+            dict(CachedMedia.objects.values_list("host", "refcount")),
+            {self.store.host: 1, "publisher-2": 0},
+        )
+
+
+class MultipartBodyTests(TestCase):
+    def setUp(self):
+        media_file = tempfile.NamedTemporaryFile(delete=False)
+        media_file.write(b"0123456789")
+        media_file.close()
+        self.addCleanup(os.remove, media_file.name)
+        self.source = ChunkSource(media_file.name, read_size=3)
+        self.addCleanup(self.source.close)
+
+    def test_source_slices_the_file_without_copying(self):
+        self.assertEqual(self.source.chunks(4), [(0, 4), (4, 4), (8, 2)])
+        pieces = [bytes(piece) for piece in self.source.slice(2, 5)]
+        self.assertEqual(pieces, [b"234", b"56"])
+        self.assertEqual(len(self.source.slice()), 10)
+        with self.assertRaises(ValueError):
+            self.source.slice(8, 4)
+
+    def test_source_closes_during_an_interrupted_upload(self):
+        pieces = iter(self.source.slice())
+        next(pieces)
+        self.source.close()
+
+    def test_body_streams_a_file_slice_and_can_be_resent(self):
+        body = MultipartBody(
+            fields={"command": "APPEND", "segment_index": 1},
+            file_field="media",
+            file_name="media",
+            file_body=self.source.slice(3, 4),
+        )
+        first = b"".join(bytes(piece) for piece in body)
+        self.assertEqual(len(first), len(body))
+        self.assertEqual(b"".join(bytes(piece) for piece in body), first)
+        prepared = requests.Request(
+            "POST", "http://example.com/", data=body, headers=body.headers
+        ).prepare()
+        self.assertEqual(prepared.headers["Content-Length"], str(len(body)))
+        self.assertIn(b'name="segment_index"\r\n\r\n1\r\n', first)
+        self.assertIn(b"\r\n\r\n3456\r\n--", first)
+
+
+class ChunkUploaderTests(TestCase):
+    def test_progress_is_acknowledged_in_order(self):
+        chunks = [(i * 4, 4) for i in range(6)]
+        in_flight = []
+        peak = []
+        progress = []
+        lock = threading.Lock()
+
+        def send(index, offset, length):
+            with lock:
+                in_flight.append(length)
+                peak.append(sum(in_flight))
+            # Later chunks finish first.
+            time.sleep((6 - index) * 0.01)
+            with lock:
+                in_flight.remove(length)
+
+        uploader = ChunkUploader(parallelism=4, max_bytes_in_flight=12)
+        self.assertEqual(uploader.upload(chunks, send, progress.append), 6)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 6)
+        self.assertLessEqual(max(peak), 12)
+
+    def test_failure_stops_new_chunks_and_raises(self):
+        sent = []
+
+        def send(index, offset, length):
+            sent.append(index)
+            if index == 1:
+                raise PublishError("chunk failed")
+
+        uploader = ChunkUploader(parallelism=2)
+        with self.assertRaises(PublishError):
+            uploader.upload([(i, 1) for i in range(10)], send)
+        self.assertEqual(uploader.acknowledged, 1)
+        self.assertLess(len(sent), 10)
+
+
+class UploadSessionTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        store = MediaStore(
+            root=root.name,
+            max_bytes=1024,
+            max_age=timedelta(hours=1),
+            lease=timedelta(hours=6),
+        )
+        patchers = [
+            mock.patch("socialmedia.x.media_store", store),
+            mock.patch("socialmedia.uploads.media_store", store),
+            mock.patch("socialmedia.x.time.sleep"),
+            mock.patch.object(settings, "X_MEDIA_SEGMENT_SIZE", 4),
+            mock.patch.dict(settings.UPLOAD_PARALLELISM, {"x": 1}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("socialmedia.media.get_session")
+        patcher.start().return_value.get.side_effect = self.download
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("socialmedia.x.get_session")
+        patcher.start().return_value.post.side_effect = self.post
+        self.addCleanup(patcher.stop)
+        self.appended = []
+        self.failing_segment = 2
+        self.timeouts = {}
+        self.processing_info = None
+        user = User.objects.create(username="uploader")
+        self.x = X.objects.create(
+            user=user, is_authenticated=True, access_token="a", access_token_secret="b"
+        )
+        self.posted_content = PostedContent.objects.create(
+            user=user, platform_name=Platforms.X.value
+        )
+
+    def download(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(b"0123456789")
+        return response
+
+    def post(self, url, data, **kwargs):
+        response = requests.Response()
+        if isinstance(data, dict):
+            response.status_code = 202 if data["command"] == "INIT" else 201
+            response._content = b'{"media_id": 7}'
+            if data["command"] == "FINALIZE" and self.processing_info:
+                response._content = json.dumps(
+                    {"media_id": 7, "processing_info": self.processing_info}
+                ).encode()
+            return response
+        body = b"".join(bytes(piece) for piece in data)
+        segment = int(re.search(rb'name="segment_index"\r\n\r\n(\d+)', body)[1])
+        if self.timeouts.get(segment):
+            self.timeouts[segment] -= 1
+            raise requests.Timeout("timed out")
+        if segment == self.failing_segment:
+            response.status_code = 503
+        else:
+            response.status_code = 204
+            self.appended.append(segment)
+        return response
+
+    def test_retry_resumes_from_the_first_unacknowledged_segment(self):
+        url = "https://example.com/video.mp4"
+        with self.assertRaises(PublishError):
+            upload_media_to_x(url, self.x, self.posted_content)
+        self.assertEqual(UploadSession.objects.get().acknowledged_chunks, 2)
+        self.assertEqual(self.appended, [0, 1])
+
+        self.failing_segment = None
+        self.assertEqual(
+            upload_media_to_x(url, self.x, self.posted_content), ("7", None)
+        )
+        self.assertEqual(self.appended, [0, 1, 2])
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(CachedMedia.objects.get().refcount, 0)
+
+    def test_timed_out_segment_is_sent_again(self):
+        self.failing_segment = None
+        self.timeouts = {1: 1}
+        with mock.patch("socialmedia.x.time.sleep") as sleep:
+            self.assertEqual(
+                upload_media_to_x(
+                    "https://example.com/video.mp4", self.x, self.posted_content
+                ),
+                ("7", None),
+            )
+        self.assertEqual(self.appended, [0, 1, 2])
+        sleep.assert_called_once_with(1)
+
+    def test_failed_segment_only_waits_between_attempts(self):
+        self.timeouts = {2: 1}
+        with mock.patch("socialmedia.x.time.sleep") as sleep:
+            with self.assertRaisesMessage(PublishError, "APPEND of segment 2 failed"):
+                upload_media_to_x(
+                    "https://example.com/video.mp4", self.x, self.posted_content
+                )
+        self.assertEqual(sleep.call_args_list, [mock.call(1), mock.call(2)])
+
+    def test_failed_processing_reports_the_reason(self):
+        self.failing_segment = None
+        self.processing_info = {
+            "state": "failed",
+            "error": {"message": "Unsupported codec"},
+        }
+        with self.assertRaisesMessage(
+            PublishError, "Media processing failed: Unsupported codec"
+        ):
+            upload_media_to_x(
+                "https://example.com/video.mp4", self.x, self.posted_content
+            )
+
+    def test_retry_on_another_host_starts_a_new_upload(self):
+        url = "https://example.com/video.mp4"
+        with self.assertRaises(PublishError):
+            upload_media_to_x(url, self.x, self.posted_content)
+        UploadSession.objects.update(host="publisher-2")
+        CachedMedia.objects.update(host="publisher-2")
+
+        self.failing_segment = None
+        self.assertEqual(
+            upload_media_to_x(url, self.x, self.posted_content), ("7", None)
+        )
+        self.assertEqual(self.appended, [0, 1, 0, 1, 2])
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(
+            list(CachedMedia.objects.values_list("refcount", flat=True)), [0, 0]
+        )
+
+
+class XMediaProcessingTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="processing")
+        self.x = X.objects.create(
+            user=user, is_authenticated=True, access_token="a", access_token_secret="b"
+        )
+        self.posted_content = PostedContent.objects.create(
+            user=user, platform_name=Platforms.X.value
+        )
+        patcher = mock.patch("socialmedia.x.get_session")
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(check_x_media_processing, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, status_code, content):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        return response
+
+    def test_pending_media_is_checked_by_a_follow_up_task(self):
+        processing = {"state": "pending", "check_after_secs": 7}
+        with mock.patch(
+            "socialmedia.x.upload_media_to_x", return_value=("7", processing)
+        ):
+            create_x_image_or_video_tweet(
+                "Hello", "https://example.com/v.mp4", self.x, self.posted_content
+            )
+        self.assertEqual(self.posted_content.post_status, PostStatus.PROCESSED.value)
+        self.assertEqual(self.apply_async.call_args.kwargs["countdown"], 7)
+        self.session.post.assert_not_called()
+
+        args = self.apply_async.call_args.kwargs["args"]
+        self.assertEqual(args[4], self.x.pk)
+        # The media is tweeted by the account that uploaded it.
+        X.objects.create(
+            user=self.x.user,
+            is_authenticated=True,
+            access_token="c",
+            access_token_secret="d",
+        )
+        self.session.get.return_value = self.respond(
+            200, b'{"processing_info": {"state": "succeeded"}}'
+        )
+        self.session.post.return_value = self.respond(201, b"{}")
+        check_x_media_processing(*args)
+        self.posted_content.refresh_from_db()
+        self.assertEqual(self.posted_content.post_status, PostStatus.POSTED.value)
+        self.assertEqual(
+            self.session.post.call_args.kwargs["json"]["media"], {"media_ids": ["7"]}
+        )
+        self.assertEqual(
+            self.session.post.call_args.kwargs["auth"].client.resource_owner_key, "a"
+        )
+
+    def check_with_failing_status(self):
+        self.session.get.return_value = self.respond(503, b"")
+        check_x_media_processing(
+            self.posted_content.pk, "7", "Hello", time.time() + 600, self.x.pk
+        )
+        self.posted_content.refresh_from_db()
+        self.session.post.assert_not_called()
+        self.assertEqual(self.posted_content.post_status, PostStatus.PENDING.value)
+
+    def test_failed_status_check_is_retried_on_its_own(self):
+        self.check_with_failing_status()
+        self.assertGreater(self.apply_async.call_args.kwargs["countdown"], 0)
+        self.assertEqual(self.apply_async.call_args.kwargs["args"][-1], 1)
+
+    def test_failed_status_check_is_retried_on_the_publisher_pool_in_threads_mode(
+        self,
+    ):
+        with mock.patch.object(settings, "POSTING_DISPATCH_MODE", "threads"):
+            with mock.patch("socialmedia.x.get_publisher_pool") as pool:
+                self.check_with_failing_status()
+        self.apply_async.assert_not_called()
+        platform, delay, fn, *args = pool.return_value.schedule.call_args.args
+        self.assertEqual(platform, Platforms.X.value)
+        self.assertGreater(delay, 0)
+        self.assertEqual(fn, check_x_media_processing)
+        self.assertEqual(args[-1], 1)
+
+
+class ScheduleUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="scheduler")
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        patcher = mock.patch.object(settings, "BASE_DIR", root.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, rows, **data):
+        excel_file = io.BytesIO()
+        pd.DataFrame(rows).to_excel(excel_file, index=False)
+        data["excell_file"] = SimpleUploadedFile("schedule.xlsx", excel_file.getvalue())
+        data["user_id"] = self.user.pk
+        return self.client.post(reverse("upload_file"), data)
+
+    def row(self, post_type="text", url=None):
+        scheduled_at = timezone.now() + timedelta(days=1)
+        return {
+            "type": post_type,
+            "content": "Hello",
+            "url": url,
+            "date_time": scheduled_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def test_same_file_only_schedules_publishing_platforms(self):
+        response = self.upload([self.row()], is_same="true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(ScheduledPost.objects.values_list("platform_name", flat=True)),
+            {Platforms.LINKEDIN.value, Platforms.X.value},
+        )
+
+    def test_platform_without_a_publisher_skips_its_rows(self):
+        response = self.upload([self.row()], socialmedia_name=Platforms.INSTAGRAM.value)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["response"]["skipped_platforms"],
+            [
+                {
+                    "row": 2,
+                    "platform": Platforms.INSTAGRAM.value,
+                    "error": "instagram posts are not published",
+                }
+            ],
+        )
+        self.assertFalse(ScheduledPost.objects.exists())
+
+    def test_rows_are_masked_per_platform(self):
+        rows = [
+            self.row(),
+            self.row("video", "https://example.com/v.mp4"),
+            dict(self.row(), content=None),
+        ]
+        _, platform_masks, errors, skipped = validate_schedule(
+            pd.DataFrame(rows), PUBLISHING_PLATFORMS
+        )
+        self.assertEqual(
+            {name: mask.tolist() for name, mask in platform_masks.items()},
+            {
+                Platforms.LINKEDIN.value: [True, False, False],
+                Platforms.TIKTOK.value: [False, True, False],
+                Platforms.X.value: [True, True, False],
+            },
+        )
+        self.assertEqual(
+            errors, [{"row": 4, "platform": None, "error": "Missing content"}]
+        )
+        self.assertEqual(
+            [(problem["row"], problem["platform"]) for problem in skipped],
+            [(2, Platforms.TIKTOK.value), (3, Platforms.LINKEDIN.value)],
+        )
+
+    def test_file_without_valid_rows_is_rejected(self):
+        response = self.upload([self.row()], socialmedia_name=Platforms.TIKTOK.value)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["response"]["rejected_rows"],
+            [
+                {
+                    "row": 2,
+                    "platform": Platforms.TIKTOK.value,
+                    "error": "text posts are not supported",
+                }
+            ],
+        )
+        self.assertFalse(ScheduledPost.objects.exists())
+        self.assertFalse(UserUploadedFiles.objects.exists())
+
+
+class PostClaimTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="claims")
+        Linkedin.objects.create(user=self.user, is_authenticated=True)
+        self.scheduled_at = timezone.now() - timedelta(minutes=1)
+        self.schedule = pd.DataFrame(
+            [
+                {
+                    "type": "text",
+                    "content": "Hello",
+                    "url": None,
+                    "date_time": self.scheduled_at.strftime("%Y-%m-%d %H:%M:%S"),
+                }
+            ]
+        )
+
+    def create_post(self):
+        return ScheduledPost.objects.create(
+            user=self.user,
+            platform_name=Platforms.LINKEDIN.value,
+            scheduled_at=self.scheduled_at,
+            post_type=PostType.TEXT.value,
+            content="Hello",
+            content_hash="hash",
+        )
+
+    def test_same_post_is_claimed_once(self):
+        first, duplicate = self.create_post(), self.create_post()
+        self.assertTrue(claim_scheduled_post(first))
+        self.assertFalse(claim_scheduled_post(duplicate))
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.state, ScheduledPostState.CANCELLED.value)
+        self.assertEqual(PostClaim.objects.get().scheduled_post, first)
+
+    def test_reuploaded_schedule_is_not_published_twice(self):
+        ingest_schedule(self.user, [Platforms.LINKEDIN.value], self.schedule)
+        with mock.patch.object(publish_post, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                start_social_media_posting()
+            ingest_schedule(self.user, [Platforms.LINKEDIN.value], self.schedule)
+            with self.captureOnCommitCallbacks(execute=True):
+                start_social_media_posting()
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(PostedContent.objects.count(), 1)
+        self.assertEqual(
+            sorted(ScheduledPost.objects.values_list("state", flat=True)),
+            [ScheduledPostState.CANCELLED.value, ScheduledPostState.DISPATCHED.value],
+        )
+
+    def test_post_asked_to_wait_long_goes_back_to_pending(self):
+        ingest_schedule(self.user, [Platforms.LINKEDIN.value], self.schedule)
+        with mock.patch.object(publish_post, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                start_social_media_posting()
+            scheduled_post = ScheduledPost.objects.get()
+            posted_content = PostedContent.objects.get()
+            failure = RateLimitExceeded("Slow down", retry_after=2 * 60 * 60)
+
+            def publisher(posted_content):
+                set_post_status(
+                    posted_content, PostStatus.ERROR, "Failed", failure=failure
+                )
+
+            _run_publisher(
+                scheduled_post, publisher, {"posted_content": posted_content}
+            )
+        self.assertEqual(apply_async.call_count, 1)
+        scheduled_at = scheduled_post.scheduled_at
+        scheduled_post.refresh_from_db()
+        self.assertEqual(scheduled_post.state, ScheduledPostState.PENDING.value)
+        self.assertEqual(scheduled_post.scheduled_at, scheduled_at)
+        self.assertGreater(
+            scheduled_post.next_attempt_at, timezone.now() + timedelta(minutes=119)
+        )
+        # A re-upload neither replaces the waiting post nor publishes it twice.
+        ingest_schedule(self.user, [Platforms.LINKEDIN.value], self.schedule)
+        self.assertFalse(claim_due_posts(timezone.now(), timezone.now()))
+        claimed_posts = claim_due_posts(
+            timezone.now(), timezone.now() + timedelta(hours=3)
+        )
+        self.assertEqual(len(claimed_posts), 1)
+        self.assertEqual(claimed_posts[0][0], scheduled_post)
+        self.assertEqual(claimed_posts[0][2], posted_content)
+        self.assertEqual(PostedContent.objects.count(), 1)
+
+        def publisher(posted_content):
+            set_post_status(posted_content, PostStatus.POSTED)
+
+        _run_publisher(
+            claimed_posts[0][0], publisher, {"posted_content": posted_content}
+        )
+        # Latency is measured from the original scheduled time.
+        response = self.client.get(reverse("publish_latency"))
+        latency = response.json()["response"][Platforms.LINKEDIN.value]
+        self.assertEqual(latency["count"], 1)
+        self.assertGreaterEqual(latency["max_seconds"], 0)
+        self.assertEqual(PostClaim.objects.get().scheduled_post, scheduled_post)
+
+    def test_posts_go_back_to_pending_when_the_publisher_pool_is_full(self):
+        ingest_schedule(self.user, [Platforms.LINKEDIN.value], self.schedule)
+        self.create_post()
+        with mock.patch.object(settings, "POSTING_DISPATCH_MODE", "threads"):
+            with mock.patch("socialmedia.tasks.get_publisher_pool") as pool:
+                pool.return_value.submit.side_effect = PublisherQueueFull("full")
+                with self.captureOnCommitCallbacks(execute=True):
+                    start_social_media_posting()
+        self.assertEqual(pool.return_value.submit.call_count, 1)
+        self.assertEqual(
+            set(ScheduledPost.objects.values_list("state", flat=True)),
+            {ScheduledPostState.PENDING.value},
+        )
+        self.assertFalse(PostClaim.objects.exists())
+        self.assertEqual(ScheduledPost.objects.count(), 2)
+        self.assertFalse(PostedContent.objects.exists())
+
+
+class MediaPrefetchTests(TestCase):
+    url = "https://example.com/a.jpg"
+
+    def setUp(self):
+        self.user = User.objects.create(username="prefetch")
+        Linkedin.objects.create(user=self.user, is_authenticated=True)
+        self.scheduled_at = timezone.now()
+        patcher = mock.patch("socialmedia.schedules.media_store")
+        self.media_store = patcher.start()
+        self.media_store.host = "publisher-1"
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("socialmedia.tasks.media_store", self.media_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_post(self, **kwargs):
+        fields = {
+            "user": self.user,
+            "platform_name": Platforms.LINKEDIN.value,
+            "scheduled_at": self.scheduled_at,
+            "post_type": PostType.IMAGE.value,
+            "content": "Hello",
+            "url": self.url,
+            "content_hash": "hash",
+        }
+        fields.update(kwargs)
+        return ScheduledPost.objects.create(**fields)
+
+    def test_post_claimed_during_prefetch_does_not_keep_the_media(self):
+        scheduled_post = self.create_post()
+        ScheduledPost.objects.update(state=ScheduledPostState.DISPATCHED.value)
+        with mock.patch("socialmedia.tasks.validate_media", return_value=None):
+            with mock.patch("socialmedia.tasks.close_old_connections"):
+                self.assertFalse(_prefetch_media(scheduled_post))
+        self.media_store.release.assert_called_once_with(self.url)
+        scheduled_post.refresh_from_db()
+        self.assertIsNone(scheduled_post.media_prefetched_at)
+
+    def test_cancelled_duplicate_releases_its_prefetched_media(self):
+        first = self.create_post()
+        # The instance was loaded before its media was prefetched.
+        duplicate = self.create_post()
+        ScheduledPost.objects.filter(pk=duplicate.pk).update(
+            media_prefetched_at=timezone.now(), media_prefetch_host="publisher-1"
+        )
+        self.assertTrue(claim_scheduled_post(first))
+        self.assertFalse(claim_scheduled_post(duplicate))
+        self.media_store.release.assert_called_once_with(self.url, host="publisher-1")
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.media_prefetched_at)
+
+    def test_post_without_a_publisher_releases_its_prefetched_media(self):
+        scheduled_post = self.create_post(
+            content="",
+            media_prefetched_at=timezone.now(),
+            media_prefetch_host="publisher-1",
+        )
+        claim_due_posts(
+            self.scheduled_at - timedelta(minutes=1),
+            self.scheduled_at + timedelta(minutes=1),
+        )
+        self.media_store.release.assert_called_once_with(self.url, host="publisher-1")
+        scheduled_post.refresh_from_db()
+        self.assertEqual(scheduled_post.state, ScheduledPostState.CANCELLED.value)
+        self.assertIsNone(scheduled_post.media_prefetched_at)
+
+
+class StrandedPostTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="stranded")
+        Linkedin.objects.create(user=user, is_authenticated=True)
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        self.scheduled_post = ScheduledPost.objects.create(
+            user=user,
+            platform_name=Platforms.LINKEDIN.value,
+            scheduled_at=an_hour_ago,
+            dispatched_at=an_hour_ago,
+            post_type=PostType.TEXT.value,
+            content="Hello",
+            state=ScheduledPostState.DISPATCHED.value,
+        )
+        PostedContent.objects.create(
+            user=user,
+            platform_name=Platforms.LINKEDIN.value,
+            scheduled_post=self.scheduled_post,
+        )
+        patcher = mock.patch.object(publish_post, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_post_that_never_started_is_dispatched_again(self):
+        stale_dispatch = self.scheduled_post.dispatched_at
+        redispatch_stranded_posts()
+        redispatch_stranded_posts()
+        self.scheduled_post.refresh_from_db()
+        self.assertEqual(self.apply_async.call_count, 1)
+        self.assertEqual(
+            self.apply_async.call_args.kwargs["args"],
+            [self.scheduled_post.pk, self.scheduled_post.dispatched_at.isoformat()],
+        )
+        self.assertEqual(self.scheduled_post.attempts, 1)
+        with mock.patch("socialmedia.tasks._run_publisher") as run_publisher:
+            publish_post(self.scheduled_post.pk, stale_dispatch.isoformat())
+            run_publisher.assert_not_called()
+            publish_post(*self.apply_async.call_args.kwargs["args"])
+            run_publisher.assert_called_once()
+
+    def test_started_post_is_left_alone(self):
+        ScheduledPost.objects.update(publish_started_at=timezone.now())
+        redispatch_stranded_posts()
+        self.apply_async.assert_not_called()
+
+    def test_post_dispatched_twice_is_published_once(self):
+        copies = [ScheduledPost.objects.get(), ScheduledPost.objects.get()]
+        publisher = mock.Mock()
+        for scheduled_post in copies:
+            posted_content = PostedContent.objects.get()
+            _run_publisher(
+                scheduled_post, publisher, {"posted_content": posted_content}
+            )
+        publisher.assert_called_once()
+
+
+class StatusWriterTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="statuses")
+        self.posted_content = PostedContent.objects.create(
+            user=user, platform_name=Platforms.X.value
+        )
+        self.writer = StatusWriter(max_batch=100, flush_interval=60)
+        patcher = mock.patch.object(self.writer, "_start_flusher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transitions_of_a_post_are_coalesced(self):
+        self.writer.record(self.posted_content, PostStatus.STARTED)
+        self.writer.record(self.posted_content, PostStatus.ERROR, "Failed")
+        self.assertEqual(len(self.writer._pending), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.writer.flush()
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "socialmedia_postedcontent"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.posted_content.refresh_from_db()
+        self.assertEqual(self.posted_content.post_status, PostStatus.ERROR.value)
+        self.assertEqual(self.posted_content.error_reason, "Failed")
+        self.assertEqual(
+            list(
+                PostStatusEvent.objects.order_by("pk").values_list(
+                    "post_status", flat=True
+                )
+            ),
+            [PostStatus.STARTED.value, PostStatus.ERROR.value],
+        )
+
+    def test_failed_flush_is_requeued(self):
+        self.writer.record(self.posted_content, PostStatus.STARTED)
+        with mock.patch.object(
+            PostStatusEvent.objects, "bulk_create", side_effect=RuntimeError("down")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.writer.flush()
+        self.writer.record(self.posted_content, PostStatus.POSTED)
+        self.writer.flush()
+        self.posted_content.refresh_from_db()
+        self.assertTrue(self.posted_content.is_posted)
+        self.assertEqual(
+            list(
+                PostStatusEvent.objects.order_by("pk").values_list(
+                    "post_status", flat=True
+                )
+            ),
+            [PostStatus.STARTED.value, PostStatus.POSTED.value],
+        )
+
+
+class OAuthThrottlingTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("socialmedia.clients.get_circuit_breaker")
+        self.breaker = patcher.start().return_value
+        self.breaker.allow.return_value = False
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("socialmedia.clients.get_rate_limiter")
+        self.rate_limiter = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_auth_call_to_an_open_circuit_fails_with_503(self):
+        self.breaker.allow.side_effect = CircuitOpen("open", 30.2)
+        response = self.client.get(reverse("get_x_auth"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "31")
+        self.rate_limiter.acquire.assert_not_called()
+
+    def test_throttled_auth_call_fails_fast_with_429(self):
+        self.rate_limiter.acquire.side_effect = RateLimitExceeded("limited", 12.5)
+        response = self.client.get(reverse("get_x_auth"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "13")
+        self.assertEqual(self.rate_limiter.acquire.call_args.kwargs["max_wait"], 0)
+
+
+class FakeRedis:
+    """The part of redis.Redis the circuit breaker uses, on a settable clock."""
+
+    def __init__(self):
+        self.now = 0
+        self.values = {}
+        self.expires_at = {}
+
+    def _get(self, key):
+        if self.expires_at.get(key, float("inf")) <= self.now:
+            self.delete(key)
+        return self.values.get(key)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def pttl(self, key):
+        if self._get(key) is None:
+            return -2
+        if key not in self.expires_at:
+            return -1
+        return int((self.expires_at[key] - self.now) * 1000)
+
+    def exists(self, key):
+        return int(self._get(key) is not None)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self._get(key) is not None:
+            return None
+        self.values[key] = value
+        self.expires_at.pop(key, None)
+        if px:
+            self.expires_at[key] = self.now + px / 1000
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.expires_at.pop(key, None)
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def hincrby(self, key, field, amount):
+        counts = self.values.setdefault(key, {})
+        counts[field.encode()] = counts.get(field.encode(), 0) + amount
+        return counts[field.encode()]
+
+    def expire(self, key, seconds):
+        self.expires_at[key] = self.now + seconds
+
+    def hgetall(self, key):
+        return dict(self._get(key) or {})
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+
+        return command
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            redis_url="redis://localhost:6379/0",
+            window=60,
+            min_requests=2,
+            error_rate=0.5,
+            open_seconds=120,
+            probe_timeout=10,
+        )
+        self.redis = self.breaker._redis = FakeRedis()
+
+    def trip(self):
+        for _ in range(2):
+            self.breaker.record(Platforms.X.value, "publish", failed=True)
+        self.redis.now += 121
+
+    def test_breaker_opens_after_enough_failures(self):
+        self.breaker.record(Platforms.X.value, "publish", failed=True)
+        self.assertFalse(self.breaker.allow(Platforms.X.value, "publish"))
+        self.breaker.record(Platforms.X.value, "publish", failed=True)
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.allow(Platforms.X.value, "publish")
+        self.assertEqual(raised.exception.retry_after, 120)
+        self.assertEqual(
+            self.breaker.get_blocked_seconds(Platforms.X.value, "publish"), 120
+        )
+        self.assertFalse(self.breaker.allow(Platforms.X.value, "media"))
+
+    def test_successful_probe_closes_the_breaker(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow(Platforms.X.value, "publish"))
+        # Only one probe is let through while the breaker is half-open.
+        with self.assertRaises(CircuitOpen):
+            self.breaker.allow(Platforms.X.value, "publish")
+        self.breaker.record(Platforms.X.value, "publish", failed=False, is_probe=True)
+        self.assertFalse(self.breaker.allow(Platforms.X.value, "publish"))
+        self.assertFalse(self.breaker.allow(Platforms.X.value, "publish"))
+
+    def test_failed_probe_opens_the_breaker_again(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow(Platforms.X.value, "publish"))
+        self.breaker.record(Platforms.X.value, "publish", failed=True, is_probe=True)
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.allow(Platforms.X.value, "publish")
+        self.assertEqual(raised.exception.retry_after, 120)
+
+    def test_released_probe_lets_the_next_call_probe(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow(Platforms.X.value, "publish"))
+        self.breaker.release_probe(Platforms.X.value, "publish")
+        self.assertTrue(self.breaker.allow(Platforms.X.value, "publish"))
+        # A probe that never reports back expires after probe_timeout.
+        self.redis.now += 11
+        self.assertTrue(self.breaker.allow(Platforms.X.value, "publish"))
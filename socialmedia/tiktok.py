@@ -1,38 +1,24 @@
-import requests
 import digitalplatform.settings as settings
 from .models import TikTok, PostedContent
 from datetime import datetime, timedelta
-import uuid
 import pandas as pd
-from .enums import PostStatus, PostType
+from .enums import EndpointFamily, PostStatus, PostType, Platforms
+from .clients import ChunkSource, get_session
+from .media import media_store
+from .status import set_post_status
+from .retries import PublishError
+from .uploads import (
+    ChunkUploader,
+    close_upload_session,
+    get_upload_session,
+    open_upload_session,
+    record_upload_progress,
+)
+import logging
 import math
 import os
 
-
-def download_video_from_url(video_url):
-    try:
-        base_dir = settings.BASE_DIR
-
-        save_dir = os.path.join(base_dir, "videos")
-        os.makedirs(save_dir, exist_ok=True)
-
-        response = requests.get(video_url, stream=True)
-        if response.status_code != 200:
-            raise Exception(
-                f"Failed to download video, status code: {response.status_code}"
-            )
-
-        filename = str(uuid.uuid4()) + ".mp4"
-        save_path = os.path.join(save_dir, filename)
-
-        with open(save_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-
-        return save_path
-    except Exception as e:
-        return None
+logger = logging.getLogger(__name__)
 
 
 def authorize_user_tiktok(code: str):
@@ -47,7 +33,9 @@ def authorize_user_tiktok(code: str):
         "redirect_uri": settings.TIKTOK_REDIRECT_URL,
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    get_access_and_refresh_tokens = requests.post(url, data=data, headers=headers)
+    get_access_and_refresh_tokens = get_session(Platforms.TIKTOK.value).post(
+        url, data=data, headers=headers, endpoint_family=EndpointFamily.AUTH.value
+    )
     try:
         get_access_and_refresh_tokens.raise_for_status()
     except Exception as e:
@@ -65,7 +53,13 @@ def refresh_tiktok_access_token(user_tiktok: TikTok):
         "grant_type": "refresh_token",
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    get_access_and_refresh_tokens = requests.post(url, data=data, headers=headers)
+    get_access_and_refresh_tokens = get_session(Platforms.TIKTOK.value).post(
+        url,
+        data=data,
+        headers=headers,
+        rate_limit_key=user_tiktok.user_id,
+        endpoint_family=EndpointFamily.AUTH.value,
+    )
     try:
         get_access_and_refresh_tokens.raise_for_status()
     except Exception as e:
@@ -100,117 +94,90 @@ def post_video_on_tiktok(
     user_tiktok: TikTok, video_url: str, posted_content: PostedContent, content: str
 ):
     if not user_tiktok or not user_tiktok.is_authenticated:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            "User not authenticated or TikTok profile not found"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "User not authenticated or TikTok profile not found",
         )
-        posted_content.save()
         return
     access_token = user_tiktok.access_token
     if not access_token:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = "Access token not found"
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.ERROR, "Access token not found")
         return
-    video_path = download_video_from_url(video_url=video_url)
-    if not video_path:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = "Failed to download video from URL"
-        posted_content.save()
+    try:
+        video_path = media_store.acquire(video_url)
+    except Exception as e:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"Failed to download video from URL: {e}",
+            failure=e,
+        )
         return
-    posted_content.post_status = PostStatus.STARTED.value
-    posted_content.save()
-
-    video_size = os.path.getsize(video_path)
-    min_chunk = 5 * 1024 * 1024
-    max_chunk = 64 * 1024 * 1024
-    max_final_chunk = 128 * 1024 * 1024
-    max_chunks = 1000
-
-    if video_size < min_chunk or video_size <= max_chunk:
-        chunk_size = video_size
-        total_chunk_count = 1
-    else:
-        chunk_size = min(max_chunk, math.ceil(video_size / max_chunks))
-        total_chunk_count = math.floor(video_size / chunk_size)
-        if video_size % chunk_size != 0:
-            total_chunk_count += 1
-
-    url = f"{settings.TIKTOK_API_URL}post/publish/creator_info/query/"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json; charset=UTF-8",
-    }
+    set_post_status(posted_content, PostStatus.STARTED)
 
     try:
-        response = requests.post(url, headers=headers)
-        if response.status_code not in [200, 201]:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Failed to fetch creator info"
-            posted_content.save()
-            return
-
-        creator_data = response.json().get("data")
-        if not creator_data:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Creator data not found"
-            posted_content.save()
-            return
-
-        privacy_options = creator_data.get("privacy_level_options", ["SELF_ONLY"])
-        comment_disabled = creator_data.get("comment_disabled", False)
-        duet_disabled = creator_data.get("duet_disabled", False)
-        stitch_disabled = creator_data.get("stitch_disabled", True)
-
-        upload_video_url = f"{settings.TIKTOK_API_URL}post/publish/video/init/"
-        post_video_headers = headers.copy()
-        post_video_data = {
-            "post_info": {
-                "title": content if content else "#fypost",
-                "privacy_level": "SELF_ONLY",
-                "disable_duet": duet_disabled,
-                "disable_comment": comment_disabled,
-                "disable_stitch": stitch_disabled,
-            },
-            "source_info": {
-                "source": "FILE_UPLOAD",
-                "video_size": video_size,
-                "chunk_size": chunk_size,
-                "total_chunk_count": total_chunk_count,
-            },
-        }
-        post_video_response = requests.post(
-            upload_video_url, headers=post_video_headers, json=post_video_data
-        )
-        if post_video_response.status_code not in [200, 201]:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Failed to initiate video upload"
-            posted_content.save()
-            return
-        posted_content.post_status = PostStatus.PROCESSED.value
-        posted_content.save()
-        post_video_response_data = post_video_response.json().get("data")
-        if not post_video_response_data:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Failed to get video upload URL"
-            posted_content.save()
-            return
-
-        url_for_video_upload = post_video_response_data.get("upload_url")
-        with open(video_path, "rb") as f:
-            for i in range(total_chunk_count):
-                start_byte = i * chunk_size
-                end_byte = min((i + 1) * chunk_size - 1, video_size - 1)
-                f.seek(start_byte)
-                chunk_data = f.read(end_byte - start_byte + 1)
+        # A retry of a partly uploaded video continues its previous upload.
+        upload_session = get_upload_session(posted_content, video_url, video_path)
+        if upload_session:
+            logger.info(
+                f"Resuming TikTok upload at chunk {upload_session.acknowledged_chunks + 1}/{upload_session.total_chunks}"
+            )
+        else:
+            video_size = os.path.getsize(video_path)
+            min_chunk = 5 * 1024 * 1024
+            max_chunk = 64 * 1024 * 1024
+            max_final_chunk = 128 * 1024 * 1024
+            max_chunks = 1000
+
+            if video_size < min_chunk or video_size <= max_chunk:
+                chunk_size = video_size
+                total_chunk_count = 1
+            else:
+                chunk_size = min(max_chunk, math.ceil(video_size / max_chunks))
+                total_chunk_count = math.floor(video_size / chunk_size)
+                if video_size % chunk_size != 0:
+                    total_chunk_count += 1
+
+            url_for_video_upload = init_tiktok_video_upload(
+                user_tiktok,
+                posted_content,
+                content,
+                video_size,
+                chunk_size,
+                total_chunk_count,
+            )
+            if not url_for_video_upload:
+                return
+            # TikTok upload URLs are valid for an hour.
+            upload_session = open_upload_session(
+                posted_content,
+                Platforms.TIKTOK.value,
+                video_url,
+                video_path,
+                chunk_size,
+                total_chunk_count,
+                expires_in=3600,
+                upload_url=url_for_video_upload,
+            )
+
+        video_size = upload_session.file_size
+        total_chunk_count = upload_session.total_chunks
+        with ChunkSource(video_path, read_size=settings.MEDIA_CHUNK_SIZE) as source:
+
+            def upload_chunk(i, start_byte, length):
+                end_byte = start_byte + length - 1
+                chunk_data = source.slice(start_byte, length)
                 upload_video_headers = {
                     "Content-Type": "video/mp4",
                     "Content-Length": str(len(chunk_data)),
                     "Content-Range": f"bytes {start_byte}-{end_byte}/{video_size}",
                 }
-                response_of_chunk_upload = requests.put(
-                    url_for_video_upload,
+                response_of_chunk_upload = get_session(Platforms.TIKTOK.value).put(
+                    upload_session.upload_url,
                     headers=upload_video_headers,
+                    rate_limit_key=user_tiktok.user_id,
+                    endpoint_family=EndpointFamily.MEDIA.value,
                     data=chunk_data,
                     timeout=(10, 480),
                 )
@@ -218,20 +185,121 @@ def post_video_on_tiktok(
                     print(
                         f"Failed to upload chunk {i + 1}/{total_chunk_count}, status code: {response_of_chunk_upload.status_code}"
                     )
-                    posted_content.post_status = PostStatus.ERROR.value
-                    posted_content.error_reason = f"Failed to post video chunk {i + 1}/{total_chunk_count}, posting response: {response_of_chunk_upload.text}"
-                    posted_content.save()
-                    return
-
-        posted_content.post_status = PostStatus.POSTED.value
-        posted_content.is_posted = True
-        posted_content.save()
+                    raise PublishError(
+                        f"Failed to post video chunk {i + 1}/{total_chunk_count}, posting response: {response_of_chunk_upload.text}",
+                        response_of_chunk_upload,
+                    )
+
+            uploader = ChunkUploader(
+                parallelism=settings.UPLOAD_PARALLELISM.get(Platforms.TIKTOK.value, 1),
+                max_bytes_in_flight=settings.UPLOAD_MAX_BYTES_IN_FLIGHT,
+            )
+            try:
+                uploader.upload(
+                    source.chunks(upload_session.chunk_size),
+                    upload_chunk,
+                    on_progress=lambda acknowledged: record_upload_progress(
+                        upload_session, acknowledged
+                    ),
+                    start=upload_session.acknowledged_chunks,
+                )
+            except PublishError as e:
+                set_post_status(
+                    posted_content, PostStatus.ERROR, str(e), failure=e.failure
+                )
+                return
+
+        close_upload_session(posted_content)
+        set_post_status(posted_content, PostStatus.POSTED)
         return
     except Exception as e:
         print(f"Error while uploading video to TikTok: {e}")
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = f"Error while uploading video to TikTok: {e}"
-        posted_content.save()
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"Error while uploading video to TikTok: {e}",
+            failure=e,
+        )
     finally:
-        if os.path.isfile(video_path):
-            os.remove(video_path)
+        media_store.release(video_url)
+
+
+def init_tiktok_video_upload(
+    user_tiktok: TikTok,
+    posted_content: PostedContent,
+    content: str,
+    video_size: int,
+    chunk_size: int,
+    total_chunk_count: int,
+):
+    """Start a FILE_UPLOAD post and return its upload URL, or None on failure."""
+    url = f"{settings.TIKTOK_API_URL}post/publish/creator_info/query/"
+    headers = {
+        "Authorization": f"Bearer {user_tiktok.access_token}",
+        "Content-Type": "application/json; charset=UTF-8",
+    }
+    response = get_session(Platforms.TIKTOK.value).post(
+        url,
+        headers=headers,
+        rate_limit_key=user_tiktok.user_id,
+        endpoint_family=EndpointFamily.PUBLISH.value,
+    )
+    if response.status_code not in [200, 201]:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "Failed to fetch creator info",
+            failure=response,
+        )
+        return None
+
+    creator_data = response.json().get("data")
+    if not creator_data:
+        set_post_status(posted_content, PostStatus.ERROR, "Creator data not found")
+        return None
+
+    privacy_options = creator_data.get("privacy_level_options", ["SELF_ONLY"])
+    comment_disabled = creator_data.get("comment_disabled", False)
+    duet_disabled = creator_data.get("duet_disabled", False)
+    stitch_disabled = creator_data.get("stitch_disabled", True)
+
+    upload_video_url = f"{settings.TIKTOK_API_URL}post/publish/video/init/"
+    post_video_headers = headers.copy()
+    post_video_data = {
+        "post_info": {
+            "title": content if content else "#fypost",
+            "privacy_level": "SELF_ONLY",
+            "disable_duet": duet_disabled,
+            "disable_comment": comment_disabled,
+            "disable_stitch": stitch_disabled,
+        },
+        "source_info": {
+            "source": "FILE_UPLOAD",
+            "video_size": video_size,
+            "chunk_size": chunk_size,
+            "total_chunk_count": total_chunk_count,
+        },
+    }
+    post_video_response = get_session(Platforms.TIKTOK.value).post(
+        upload_video_url,
+        headers=post_video_headers,
+        json=post_video_data,
+        rate_limit_key=user_tiktok.user_id,
+        endpoint_family=EndpointFamily.MEDIA.value,
+    )
+    if post_video_response.status_code not in [200, 201]:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "Failed to initiate video upload",
+            failure=post_video_response,
+        )
+        return None
+    set_post_status(posted_content, PostStatus.PROCESSED)
+    post_video_response_data = post_video_response.json().get("data")
+    if not post_video_response_data:
+        set_post_status(
+            posted_content, PostStatus.ERROR, "Failed to get video upload URL"
+        )
+        return None
+    return post_video_response_data.get("upload_url")
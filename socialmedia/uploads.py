@@ -0,0 +1,152 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from django.utils import timezone
+import digitalplatform.settings as settings
+from .media import media_store
+from .models import UploadSession
+
+
+class ChunkUploader:
+    """Sends the chunks of one upload, up to `parallelism` at a time.
+
+    `send(index, offset, length)` uploads a single chunk and raises on
+    failure. Chunks are started in order and never more than
+    `max_bytes_in_flight` bytes are outstanding (a chunk larger than the cap
+    is sent on its own). Completions are tracked in order: `acknowledged` is
+    the number of leading chunks known to be uploaded, and `on_progress` is
+    called whenever it grows. After a failure no new chunks are started; the
+    ones in flight are allowed to finish and the first error is raised.
+    """
+
+    def __init__(self, parallelism: int = 1, max_bytes_in_flight=None):
+        self.parallelism = max(1, parallelism)
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.acknowledged = 0
+        self.bytes_in_flight = 0
+        self._completed = set()
+
+    def upload(self, chunks: list, send, on_progress=None, start: int = 0):
+        """Upload `chunks`, (offset, length) pairs, beginning at index `start`."""
+        self.acknowledged = start
+        self._completed = set()
+        if self.parallelism == 1:
+            for index in range(start, len(chunks)):
+                send(index, *chunks[index])
+                self._complete(index, on_progress)
+            return self.acknowledged
+        pending = {}
+        error = None
+        with ThreadPoolExecutor(
+            max_workers=self.parallelism, thread_name_prefix="chunk-upload"
+        ) as executor:
+            index = start
+            while pending or (index < len(chunks) and error is None):
+                while (
+                    error is None
+                    and index < len(chunks)
+                    and len(pending) < self.parallelism
+                    and self._has_room(chunks[index][1], pending)
+                ):
+                    offset, length = chunks[index]
+                    self.bytes_in_flight += length
+                    pending[executor.submit(send, index, offset, length)] = index
+                    index += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=pending.get):
+                    chunk_index = pending.pop(future)
+                    self.bytes_in_flight -= chunks[chunk_index][1]
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                        continue
+                    self._complete(chunk_index, on_progress)
+        if error is not None:
+            raise error
+        return self.acknowledged
+
+    def _has_room(self, length: int, pending: dict):
+        if not pending or self.max_bytes_in_flight is None:
+            return True
+        return self.bytes_in_flight + length <= self.max_bytes_in_flight
+
+    def _complete(self, index: int, on_progress):
+        self._completed.add(index)
+        acknowledged = self.acknowledged
+        while self.acknowledged in self._completed:
+            self._completed.discard(self.acknowledged)
+            self.acknowledged += 1
+        if on_progress and self.acknowledged > acknowledged:
+            on_progress(self.acknowledged)
+
+
+def get_upload_session(posted_content, media_url: str, file_path: str):
+    """Return the upload session a post can resume, or None.
+
+    A session is resumed only on the host that staged the file, for the same
+    file, before the platform's upload expires; otherwise it is closed.
+    """
+    upload_session = UploadSession.objects.filter(posted_content=posted_content).first()
+    if not upload_session:
+        return None
+    if (
+        upload_session.host == media_store.host
+        and upload_session.media_url == media_url
+        and upload_session.file_path == file_path
+        and upload_session.file_size == os.path.getsize(file_path)
+        and upload_session.expires_at > timezone.now()
+    ):
+        return upload_session
+    close_upload_session(posted_content)
+    return None
+
+
+def open_upload_session(
+    posted_content,
+    platform_name: str,
+    media_url: str,
+    file_path: str,
+    chunk_size: int,
+    total_chunks: int,
+    expires_in: float,
+    upload_url=None,
+    media_id=None,
+):
+    """Persist a new upload session.
+
+    The session holds its own media store reference to `media_url`, so the
+    staged file outlives the attempt until `close_upload_session`. Sessions
+    never outlive the media store lease.
+    """
+    expires_in = min(expires_in, settings.MEDIA_CACHE_LEASE.total_seconds())
+    media_store.retain(media_url)
+    return UploadSession.objects.create(
+        posted_content=posted_content,
+        host=media_store.host,
+        platform_name=platform_name,
+        media_url=media_url,
+        file_path=file_path,
+        file_size=os.path.getsize(file_path),
+        upload_url=upload_url,
+        media_id=media_id,
+        chunk_size=chunk_size,
+        total_chunks=total_chunks,
+        expires_at=timezone.now() + timedelta(seconds=expires_in),
+    )
+
+
+def record_upload_progress(upload_session: UploadSession, acknowledged: int):
+    upload_session.acknowledged_chunks = acknowledged
+    UploadSession.objects.filter(pk=upload_session.pk).update(
+        acknowledged_chunks=acknowledged, updated_on=timezone.now()
+    )
+
+
+def close_upload_session(posted_content):
+    """Delete a post's upload session and release the media it held."""
+    upload_session = UploadSession.objects.filter(posted_content=posted_content).first()
+    if not upload_session:
+        return
+    deleted, _ = UploadSession.objects.filter(pk=upload_session.pk).delete()
+    if deleted:
+        media_store.release(upload_session.media_url, host=upload_session.host)
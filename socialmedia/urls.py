@@ -29,6 +29,11 @@ urlpatterns = [
     path("get_x_auth/", views.GetXAuthorizationURLView.as_view(), name="get_x_auth"),
     path("verify_x/", views.VerifyTwitterView.as_view(), name="verify_x"),
     path("posts_stats/", views.GetPostStatsView.as_view(), name="verify_x"),
+    path(
+        "publish_latency/",
+        views.GetPublishLatencyView.as_view(),
+        name="publish_latency",
+    ),
     path(
         "user_accounts/",
         views.GetUserSocialMediaAccountsView.as_view(),
@@ -1,8 +1,12 @@
+import math
 from rest_framework.response import Response
 from rest_framework import status as rest_status
+from rest_framework.views import exception_handler as rest_exception_handler
+from .breakers import CircuitOpen
+from .ratelimit import RateLimitExceeded
 
 
-def RESPONSE(message: str, status: bool, status_code: int, response):
+def RESPONSE(message: str, status: bool, status_code: int, response, headers=None):
     http_status = rest_status.HTTP_500_INTERNAL_SERVER_ERROR
     if status_code == 200:
         http_status = rest_status.HTTP_200_OK
@@ -10,6 +14,10 @@ def RESPONSE(message: str, status: bool, status_code: int, response):
         http_status = rest_status.HTTP_201_CREATED
     elif status_code == 404:
         http_status = rest_status.HTTP_404_NOT_FOUND
+    elif status_code == 429:
+        http_status = rest_status.HTTP_429_TOO_MANY_REQUESTS
+    elif status_code == 503:
+        http_status = rest_status.HTTP_503_SERVICE_UNAVAILABLE
     else:
         http_status = rest_status.HTTP_400_BAD_REQUEST
     return Response(
@@ -20,4 +28,27 @@ def RESPONSE(message: str, status: bool, status_code: int, response):
             "response": response,
         },
         status=http_status,
+        headers=headers,
     )
+
+
+def exception_handler(exc, context):
+    """Answer views whose platform calls are throttled with a 429, or with a 503
+    while the platform's circuit is open."""
+    if isinstance(exc, RateLimitExceeded):
+        return RESPONSE(
+            message="Too many requests to the platform, please try again later",
+            status=False,
+            status_code=429,
+            response=None,
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+    if isinstance(exc, CircuitOpen):
+        return RESPONSE(
+            message="The platform is unavailable, please try again later",
+            status=False,
+            status_code=503,
+            response=None,
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+    return rest_exception_handler(exc, context)
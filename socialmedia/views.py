@@ -1,9 +1,19 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
-from .models import UserUploadedFiles, Linkedin, TikTok, X, Instagram, PostedContent
-from .enums import Platforms
+from .models import (
+    UserUploadedFiles,
+    Linkedin,
+    TikTok,
+    X,
+    Instagram,
+    PostedContent,
+    ScheduledPost,
+)
+from .enums import EndpointFamily, Platforms
+from .clients import get_session
 from .utils import RESPONSE
+from .schedules import PUBLISHING_PLATFORMS, ingest_schedule
 import pandas as pd
 import digitalplatform.settings as settings
 from datetime import timedelta, datetime
@@ -202,6 +212,29 @@ class GetExcellFileView(APIView):
                 status_code=400,
                 response=e,
             )
+        # Instagram has no publisher, so a shared file only schedules the others.
+        platform_names = PUBLISHING_PLATFORMS if is_same else [social_media_name]
+        try:
+            scheduled_posts_count, rejected_rows, skipped_platforms = ingest_schedule(
+                user, platform_names, df
+            )
+        except Exception as e:
+            print(f"Error scheduling posts from file: {e}")
+            os.remove(csv_path)
+            return RESPONSE(
+                message="There was an error scheduling posts from file",
+                status=False,
+                status_code=400,
+                response=None,
+            )
+        if not scheduled_posts_count and not skipped_platforms:
+            os.remove(csv_path)
+            return RESPONSE(
+                message="No valid rows found in file",
+                status=False,
+                status_code=400,
+                response={"rejected_rows": rejected_rows},
+            )
         user_files, created = UserUploadedFiles.objects.get_or_create(user=user)
         if is_same:
             prev_file = user_files.linkedin_file_path
@@ -240,7 +273,11 @@ class GetExcellFileView(APIView):
             message="File Uploaded Successfully. Please make it suer you upload different file for tiktok",
             status=True,
             status_code=200,
-            response=None,
+            response={
+                "scheduled_posts": scheduled_posts_count,
+                "rejected_rows": rejected_rows,
+                "skipped_platforms": skipped_platforms,
+            },
         )
 
 
@@ -433,7 +470,9 @@ class GetXAuthorizationURLView(APIView):
                 "User-Agent": "MyApp",
             }
 
-            res = requests.post(url, headers=headers)
+            res = get_session(Platforms.X.value).post(
+                url, headers=headers, endpoint_family=EndpointFamily.AUTH.value
+            )
             res.raise_for_status()
             data = dict(parse_qsl(res.text))
             request_token = data.get("oauth_token")
@@ -553,7 +592,9 @@ class VerifyTwitterView(APIView):
             "User-Agent": "custom-oauth-client",
         }
         data = {"oauth_verifier": oauth_verifier}
-        response = requests.post(url, headers=headers, data=data)
+        response = get_session(Platforms.X.value).post(
+            url, headers=headers, data=data, endpoint_family=EndpointFamily.AUTH.value
+        )
 
         if response.status_code != 200:
             return RESPONSE(
@@ -578,8 +619,10 @@ class VerifyTwitterView(APIView):
             resource_owner_key=access_token,
             resource_owner_secret=access_token_secret,
         )
-        fetch_profile = requests.get(
-            f"{settings.X_API_URL}1.1/account/verify_credentials.json", auth=auth
+        fetch_profile = get_session(Platforms.X.value).get(
+            f"{settings.X_API_URL}1.1/account/verify_credentials.json",
+            auth=auth,
+            endpoint_family=EndpointFamily.AUTH.value,
         )
         if fetch_profile.status_code != 200:
             return RESPONSE(
@@ -650,6 +693,44 @@ class GetPostStatsView(APIView):
         )
 
 
+class GetPublishLatencyView(APIView):
+    def get(self, request):
+        hours = request.query_params.get("hours", 24)
+        try:
+            hours = int(hours)
+        except ValueError:
+            return RESPONSE(
+                message="Hours must be an integer",
+                status=False,
+                status_code=400,
+                response=None,
+            )
+        published_posts = ScheduledPost.objects.filter(
+            publish_started_at__gte=timezone.now() - timedelta(hours=hours)
+        ).values_list("platform_name", "scheduled_at", "publish_started_at")
+        lateness_by_platform = {}
+        for platform_name, scheduled_at, publish_started_at in published_posts:
+            lateness_by_platform.setdefault(platform_name, []).append(
+                (publish_started_at - scheduled_at).total_seconds()
+            )
+        latency_stats = {}
+        for platform_name, lateness in lateness_by_platform.items():
+            lateness.sort()
+            latency_stats[platform_name] = {
+                "count": len(lateness),
+                "avg_seconds": sum(lateness) / len(lateness),
+                "p50_seconds": lateness[int(0.5 * (len(lateness) - 1))],
+                "p95_seconds": lateness[int(0.95 * (len(lateness) - 1))],
+                "max_seconds": lateness[-1],
+            }
+        return RESPONSE(
+            message="Publish Latency Retrieved Successfully",
+            status=True,
+            status_code=200,
+            response=latency_stats,
+        )
+
+
 class GetUserSocialMediaAccountsView(APIView):
     def get(self, request):
         user_id = request.query_params.get("user_id", None)
@@ -1,18 +1,51 @@
-from requests_oauthlib import OAuth1
 import requests
+from requests_oauthlib import OAuth1
 import digitalplatform.settings as settings
 from .models import X, PostedContent
 from datetime import datetime, timedelta
-from .enums import PostStatus
-import uuid
+from .enums import EndpointFamily, PostStatus, Platforms
+from .clients import ChunkSource, MultipartBody, get_session
+from .media import media_store
+from .publishers import get_publisher_pool
+from .status import set_post_status
+from .retries import (
+    PublishError,
+    get_retry_after,
+    get_retry_delay,
+    is_transient_failure,
+)
+from .uploads import (
+    ChunkUploader,
+    close_upload_session,
+    get_upload_session,
+    open_upload_session,
+    record_upload_progress,
+)
+import logging
+import math
 import mimetypes
 import time
 import os
 
+logger = logging.getLogger(__name__)
+
 
-def upload_media_to_x(url: str, x: X):
+def upload_media_to_x(url: str, x: X, posted_content: PostedContent = None):
+    """Upload media to X and return (media_id, processing_info).
+
+    `processing_info` is None when the media can be attached right away. For a
+    video X is still transcoding it is the FINALIZE processing_info, and
+    `check_x_media_status` must report success before the media is used.
+    """
     if not x.is_authenticated or not x.access_token or not x.access_token_secret:
-        return None
+        return None, None
+    with media_store.open(url) as file_path:
+        return upload_file_to_x(file_path, url, x, posted_content)
+
+
+def upload_file_to_x(
+    file_path: str, url: str, x: X, posted_content: PostedContent = None
+):
     access_token = x.access_token
     access_token_secret = x.access_token_secret
     auth = OAuth1(
@@ -21,140 +54,175 @@ def upload_media_to_x(url: str, x: X):
         resource_owner_key=access_token,
         resource_owner_secret=access_token_secret,
     )
-    get_file = requests.get(url)
-    if get_file.status_code != 200:
-        print(f"Failed to download media file: {get_file.text}")
-        return None
-    filename = str(uuid.uuid4())
-    if url.lower().endswith((".mp4", ".mov", ".avi", ".mkv")):
-        filename += ".mp4"
-    else:
-        filename += ".jpg"
-    dir_path = os.path.join(settings.BASE_DIR, "x")
-    os.makedirs(dir_path, exist_ok=True)
-    file_path = os.path.join(dir_path, filename)
-    with open(file_path, "wb") as media_file:
-        media_file.write(get_file.content)
     upload_url = f"{settings.X_UPLOAD_URL}1.1/media/upload.json"
-    if filename.endswith(".mp4"):
-        initialzing_payload = {
-            "command": "INIT",
-            "total_bytes": os.path.getsize(file_path),
-            "media_type": mimetypes.guess_type(file_path),
-            "media_category": "tweet_video",
-        }
-        init_resp = requests.post(upload_url, auth=auth, data=initialzing_payload)
-        if init_resp.status_code not in (201, 202):
-            print(f"INIT failed: {init_resp.text}")
-            return None
-        media_id = init_resp.json().get("media_id")
-        if not media_id:
-            print("Failed to get media_id from INIT response.")
-            return None
-        with open(file_path, "rb") as media_file:
-            try:
-                media_file.seek(0)
-                segment_id = 0
-                chunk_size = 4 * 1024 * 1024
-                while True:
-                    chunk = media_file.read(chunk_size)
-                    if not chunk:
-                        break
-                    append_data = {
-                        "command": "APPEND",
-                        "media_id": media_id,
-                        "segment_index": segment_id,
-                    }
-                    files = {"media": chunk}
-                    for retry in range(3):
-                        append_resp = requests.post(
+    if url.lower().endswith((".mp4", ".mov", ".avi", ".mkv")):
+        # A retry of a partly uploaded video continues its previous upload.
+        upload_session = (
+            get_upload_session(posted_content, url, file_path)
+            if posted_content
+            else None
+        )
+        if upload_session:
+            media_id = upload_session.media_id
+            logger.info(
+                f"Resuming X upload of media {media_id} at segment {upload_session.acknowledged_chunks + 1}/{upload_session.total_chunks}"
+            )
+        else:
+            initialzing_payload = {
+                "command": "INIT",
+                "total_bytes": os.path.getsize(file_path),
+                "media_type": mimetypes.guess_type(file_path),
+                "media_category": "tweet_video",
+            }
+            init_resp = get_session(Platforms.X.value).post(
+                upload_url,
+                auth=auth,
+                data=initialzing_payload,
+                rate_limit_key=x.user_id,
+                endpoint_family=EndpointFamily.MEDIA.value,
+            )
+            if init_resp.status_code not in (201, 202):
+                raise PublishError(f"INIT failed: {init_resp.text}", init_resp)
+            media_id = init_resp.json().get("media_id")
+            if not media_id:
+                raise PublishError(f"INIT returned no media_id: {init_resp.text}")
+            if posted_content:
+                segment_size = settings.X_MEDIA_SEGMENT_SIZE
+                upload_session = open_upload_session(
+                    posted_content,
+                    Platforms.X.value,
+                    url,
+                    file_path,
+                    segment_size,
+                    math.ceil(os.path.getsize(file_path) / segment_size),
+                    expires_in=init_resp.json().get("expires_after_secs", 86400),
+                    media_id=str(media_id),
+                )
+        with ChunkSource(file_path, read_size=settings.MEDIA_CHUNK_SIZE) as source:
+
+            def append_segment(segment_id, offset, length):
+                append_data = {
+                    "command": "APPEND",
+                    "media_id": media_id,
+                    "segment_index": segment_id,
+                }
+                # Segments are sent from the mapped file, never copied whole.
+                body = MultipartBody(
+                    fields=append_data,
+                    file_field="media",
+                    file_name="media",
+                    file_body=source.slice(offset, length),
+                )
+                for attempt in range(3):
+                    if attempt:
+                        time.sleep(2 ** (attempt - 1))
+                    try:
+                        append_resp = get_session(Platforms.X.value).post(
                             upload_url,
                             auth=auth,
-                            data=append_data,
-                            files=files,
+                            data=body,
+                            headers=body.headers,
                             timeout=60,
+                            rate_limit_key=x.user_id,
+                            endpoint_family=EndpointFamily.MEDIA.value,
                         )
-                        if append_resp.status_code == 204:
-                            break
-                        time.sleep(2**retry)
-                    segment_id += 1
-            except Exception as e:
-                print(f"Error initializing video upload: {str(e)}")
-                return None
-            finally:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
+                    except requests.Timeout as e:
+                        failure, reason = e, str(e)
+                        continue
+                    if append_resp.status_code == 204:
+                        return
+                    failure, reason = append_resp, append_resp.text
+                raise PublishError(
+                    f"APPEND of segment {segment_id} failed: {reason}", failure
+                )
+
+            # X accepts APPEND segments in any order; FINALIZE waits for all.
+            uploader = ChunkUploader(
+                parallelism=settings.UPLOAD_PARALLELISM.get(Platforms.X.value, 1),
+                max_bytes_in_flight=settings.UPLOAD_MAX_BYTES_IN_FLIGHT,
+            )
+            # Failed segments raise, so the post is retried from the first
+            # segment X has not acknowledged.
+            if upload_session:
+                uploader.upload(
+                    source.chunks(upload_session.chunk_size),
+                    append_segment,
+                    on_progress=lambda acknowledged: record_upload_progress(
+                        upload_session, acknowledged
+                    ),
+                    start=upload_session.acknowledged_chunks,
+                )
+            else:
+                uploader.upload(
+                    source.chunks(settings.X_MEDIA_SEGMENT_SIZE), append_segment
+                )
             finalize_data = {"command": "FINALIZE", "media_id": media_id}
-            finalize_resp = requests.post(upload_url, auth=auth, data=finalize_data)
+            finalize_resp = get_session(Platforms.X.value).post(
+                upload_url,
+                auth=auth,
+                data=finalize_data,
+                rate_limit_key=x.user_id,
+                endpoint_family=EndpointFamily.MEDIA.value,
+            )
             if finalize_resp.status_code not in (200, 201):
-                print(f"FINALIZE failed: {finalize_resp.text}")
-                return None
+                raise PublishError(
+                    f"FINALIZE failed: {finalize_resp.text}", finalize_resp
+                )
+            # Every segment is in; a retry from here starts a new upload.
+            if upload_session:
+                close_upload_session(posted_content)
             proc_info = finalize_resp.json().get("processing_info")
-            if proc_info:
-                state = proc_info.get("state")
-                while state in ["pending", "in_progress"]:
-                    check_after = proc_info.get("check_after_secs", 5)
-                    time.sleep(check_after)
-                    status_params = {"command": "STATUS", "media_id": media_id}
-                    status_resp = requests.get(
-                        upload_url, auth=auth, params=status_params, timeout=30
-                    )
-                    if status_resp.status_code != 200:
-                        print(f"STATUS check failed: {status_resp.text}")
-                        return None
-                    proc_info = status_resp.json().get("processing_info")
-                    state = proc_info.get("state")
-                    if state == "failed":
-                        error_msg = proc_info.get("error", {}).get(
-                            "message", "Unknown processing error"
-                        )
-                        print(f"Processing failed: {error_msg}")
-                        return None
-        return str(media_id) if media_id and not isinstance(media_id, str) else media_id
+        media_id = str(media_id)
+        if not proc_info or proc_info.get("state") == "succeeded":
+            return media_id, None
+        if proc_info.get("state") == "failed":
+            error_msg = proc_info.get("error", {}).get(
+                "message", "Unknown processing error"
+            )
+            raise PublishError(f"Media processing failed: {error_msg}")
+        # Processing is polled by a follow-up task rather than by this worker.
+        return media_id, proc_info
     else:
-        with open(file_path, "rb") as media_file:
+        with ChunkSource(file_path, read_size=settings.MEDIA_CHUNK_SIZE) as source:
             mime_type, _ = mimetypes.guess_type(file_path)
-            try:
-                files = {
-                    "media": (
-                        media_file.name,
-                        media_file.read(),
-                        mime_type or "application/octet-stream",
-                    )
-                }
-                data = {"media_category": "tweet_image"}
-                response = requests.post(upload_url, auth=auth, files=files, data=data)
-                if response.status_code == 200:
-                    media_id = response.json().get("media_id")
-                    if media_id and not isinstance(media_id, str):
-                        media_id = str(media_id)
-                    return media_id if media_id else None
-                print(f"Simple image upload failed: {response.text}")
-                return None
-            except Exception as e:
-                print(f"Simple image upload exception: {str(e)}")
-                return None
-            finally:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
+            body = MultipartBody(
+                fields={"media_category": "tweet_image"},
+                file_field="media",
+                file_name=os.path.basename(file_path),
+                file_body=source.slice(),
+                content_type=mime_type or "application/octet-stream",
+            )
+            response = get_session(Platforms.X.value).post(
+                upload_url,
+                auth=auth,
+                data=body,
+                headers=body.headers,
+                rate_limit_key=x.user_id,
+                endpoint_family=EndpointFamily.MEDIA.value,
+            )
+            if response.status_code == 200:
+                media_id = response.json().get("media_id")
+                if media_id and not isinstance(media_id, str):
+                    media_id = str(media_id)
+                return (media_id, None) if media_id else (None, None)
+            raise PublishError(f"Simple image upload failed: {response.text}", response)
 
 
 def create_x_content_tweet(content: str, x: X, posted_content: PostedContent):
     try:
         if not x.is_authenticated or not x.access_token or not x.access_token_secret:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = (
-                "X account is not authenticated or missing access tokens."
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                "X account is not authenticated or missing access tokens.",
             )
-            posted_content.save()
             return
         if not content:
-            posted_content.post_status = PostStatus.ERROR.value
-            posted_content.error_reason = "Content cannot be empty."
-            posted_content.save()
+            set_post_status(
+                posted_content, PostStatus.ERROR, "Content cannot be empty."
+            )
             return
-        posted_content.post_status = PostStatus.PROCESSED.value
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.PROCESSED)
         access_token = x.access_token
         access_token_secret = x.access_token_secret
         auth = OAuth1(
@@ -164,28 +232,30 @@ def create_x_content_tweet(content: str, x: X, posted_content: PostedContent):
             resource_owner_secret=access_token_secret,
         )
         payload = {"text": content}
-        post_content = requests.post(
+        post_content = get_session(Platforms.X.value).post(
             f"{settings.TWITTER_BASED_API_URL}2/tweets",
             json=payload,
             auth=auth,
+            rate_limit_key=x.user_id,
+            endpoint_family=EndpointFamily.PUBLISH.value,
         )
         if post_content.status_code in [200, 201]:
-            posted_content.post_status = PostStatus.POSTED.value
-            posted_content.is_posted = True
-            posted_content.save()
+            set_post_status(posted_content, PostStatus.POSTED)
             return
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            f"Failed to post content.Response: {post_content.text}"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"Failed to post content.Response: {post_content.text}",
+            failure=post_content,
         )
-        posted_content.save()
         return
     except Exception as e:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            f"An error occurred while posting content: {str(e)}"
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            f"An error occurred while posting content: {str(e)}",
+            failure=e,
         )
-        posted_content.save()
         return
 
 
@@ -193,48 +263,163 @@ def create_x_image_or_video_tweet(
     content: str, url: str, x: X, posted_content: PostedContent
 ):
     if not x.is_authenticated or not x.access_token or not x.access_token_secret:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = (
-            "X account is not authenticated or missing access tokens."
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "X account is not authenticated or missing access tokens.",
         )
-        posted_content.save()
         return
     if not content or not url:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = "Content and URL cannot be empty."
-        posted_content.save()
+        set_post_status(
+            posted_content, PostStatus.ERROR, "Content and URL cannot be empty."
+        )
         return
-    access_token = x.access_token
-    access_token_secret = x.access_token_secret
+    media_id, processing_info = upload_media_to_x(url, x, posted_content)
+    if not media_id:
+        set_post_status(
+            posted_content,
+            PostStatus.ERROR,
+            "Failed to upload media. No Media Id Returned",
+        )
+        return
+    set_post_status(posted_content, PostStatus.PROCESSED)
+    if processing_info:
+        schedule_x_media_check(
+            content,
+            media_id,
+            x,
+            posted_content,
+            processing_info.get("check_after_secs", 5),
+            time.time() + settings.X_MEDIA_PROCESSING_TIMEOUT,
+        )
+        return
+    create_x_media_tweet(content, media_id, x, posted_content)
+
+
+def check_x_media_status(media_id: str, x: X):
+    """Return the processing_info of uploaded media from a single STATUS call."""
     auth = OAuth1(
         client_key=settings.X_CONSUMER_ID,
         client_secret=settings.X_CONSUMER_SECRET,
-        resource_owner_key=access_token,
-        resource_owner_secret=access_token_secret,
+        resource_owner_key=x.access_token,
+        resource_owner_secret=x.access_token_secret,
     )
-    payload = {"text": content}
-    media_id = upload_media_to_x(url, x)
-    if not media_id:
-        posted_content.post_status = PostStatus.ERROR.value
-        posted_content.error_reason = "Failed to upload media. No Media Id Returned"
-        posted_content.save()
+    status_resp = get_session(Platforms.X.value).get(
+        f"{settings.X_UPLOAD_URL}1.1/media/upload.json",
+        auth=auth,
+        params={"command": "STATUS", "media_id": media_id},
+        timeout=30,
+        rate_limit_key=x.user_id,
+        endpoint_family=EndpointFamily.MEDIA.value,
+    )
+    if status_resp.status_code != 200:
+        raise PublishError(f"STATUS check failed: {status_resp.text}", status_resp)
+    return status_resp.json().get("processing_info")
+
+
+def schedule_x_media_check(
+    content: str,
+    media_id: str,
+    x: X,
+    posted_content: PostedContent,
+    check_after: float,
+    deadline: float,
+    failures: int = 0,
+):
+    """Check the media again in `check_after` seconds, on the active dispatcher.
+
+    `failures` counts the STATUS calls in a row that failed transiently.
+    """
+    from .tasks import check_x_media_processing
+
+    args = [posted_content.pk, media_id, content, deadline, x.pk, failures]
+    if settings.POSTING_DISPATCH_MODE == "threads":
+        get_publisher_pool().schedule(
+            Platforms.X.value, check_after, check_x_media_processing, *args
+        )
+        return
+    check_x_media_processing.apply_async(
+        args=args,
+        queue=Platforms.X.value,
+        countdown=check_after,
+    )
+
+
+def continue_x_media_tweet(
+    content: str,
+    media_id: str,
+    x: X,
+    posted_content: PostedContent,
+    deadline: float,
+    failures: int = 0,
+):
+    """Tweet media once X has processed it, checking again later if it has not.
+
+    A STATUS call failing transiently is retried on its own with backoff; the
+    post is only failed, and retried in full, once `deadline` has passed.
+    """
+    try:
+        processing_info = check_x_media_status(media_id, x)
+    except Exception as e:
+        delay = get_retry_delay(failures, get_retry_after(e))
+        if not is_transient_failure(e) or time.time() + delay > deadline:
+            raise
+        logger.warning(
+            f"STATUS check of X media {media_id} failed, checking again in {delay:.0f}s: {str(e)}"
+        )
+        schedule_x_media_check(
+            content, media_id, x, posted_content, delay, deadline, failures + 1
+        )
         return
-    posted_content.post_status = PostStatus.PROCESSED.value
-    posted_content.save()
-    payload["media"] = {"media_ids": [str(media_id)]}
-    post_content = requests.post(
+    state = processing_info.get("state") if processing_info else "succeeded"
+    if state == "failed":
+        error_msg = processing_info.get("error", {}).get(
+            "message", "Unknown processing error"
+        )
+        set_post_status(
+            posted_content, PostStatus.ERROR, f"Media processing failed: {error_msg}"
+        )
+        return
+    if state != "succeeded":
+        check_after = processing_info.get("check_after_secs", 5)
+        if time.time() + check_after > deadline:
+            set_post_status(
+                posted_content,
+                PostStatus.ERROR,
+                f"Media {media_id} was still {state} when processing timed out",
+            )
+            return
+        schedule_x_media_check(
+            content, media_id, x, posted_content, check_after, deadline
+        )
+        return
+    create_x_media_tweet(content, media_id, x, posted_content)
+
+
+def create_x_media_tweet(
+    content: str, media_id: str, x: X, posted_content: PostedContent
+):
+    auth = OAuth1(
+        client_key=settings.X_CONSUMER_ID,
+        client_secret=settings.X_CONSUMER_SECRET,
+        resource_owner_key=x.access_token,
+        resource_owner_secret=x.access_token_secret,
+    )
+    payload = {"text": content, "media": {"media_ids": [str(media_id)]}}
+    post_content = get_session(Platforms.X.value).post(
         f"{settings.TWITTER_BASED_API_URL}2/tweets",
         json=payload,
         auth=auth,
+        rate_limit_key=x.user_id,
+        endpoint_family=EndpointFamily.PUBLISH.value,
     )
     if post_content.status_code in [200, 201]:
-        posted_content.post_status = PostStatus.POSTED.value
-        posted_content.is_posted = True
-        posted_content.save()
+        set_post_status(posted_content, PostStatus.POSTED)
         return
-    posted_content.post_status = PostStatus.ERROR.value
-    posted_content.error_reason = (
-        f"Failed to post content.Response: {post_content.text}"
+    set_post_status(
+        posted_content,
+        PostStatus.ERROR,
+        f"Failed to post content.Response: {post_content.text}",
+        failure=post_content,
     )
-    posted_content.save()
     return